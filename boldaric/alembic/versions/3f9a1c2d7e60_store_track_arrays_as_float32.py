@@ -0,0 +1,60 @@
+"""store track arrays as float32
+
+Revision ID: 3f9a1c2d7e60
+Revises: b657c1674be1
+Create Date: 2026-10-16 09:12:44.118203
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f9a1c2d7e60"
+down_revision: Union[str, None] = "b657c1674be1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ARRAY_COLUMNS = ("genre_embedding", "mfcc_covariance", "mfcc_mean")
+
+
+def _convert(from_dtype, to_dtype) -> None:
+    # Re-encode every array blob in the tracks table
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text(f"SELECT id, {', '.join(ARRAY_COLUMNS)} FROM tracks")
+    ).fetchall()
+
+    itemsize = np.dtype(from_dtype).itemsize
+    updates = []
+    for row in rows:
+        update = {"id": row[0]}
+        for column, blob in zip(ARRAY_COLUMNS, row[1:]):
+            if blob is not None and len(blob) % itemsize == 0:
+                blob = np.frombuffer(blob, dtype=from_dtype).astype(to_dtype).tobytes()
+            update[column] = blob
+        updates.append(update)
+
+    if updates:
+        conn.execute(
+            sa.text(
+                "UPDATE tracks SET "
+                + ", ".join(f"{c} = :{c}" for c in ARRAY_COLUMNS)
+                + " WHERE id = :id"
+            ),
+            updates,
+        )
+
+
+def upgrade() -> None:
+    # Arrays were previously stored as float64, but we only
+    #  ever need float32 precision. Halve the blob sizes.
+    _convert(np.float64, np.float32)
+
+
+def downgrade() -> None:
+    _convert(np.float32, np.float64)
@@ -0,0 +1,67 @@
+"""unique track history per station
+
+Revision ID: 5c7d2a9e4b18
+Revises: 8d2e4b6a1f93
+Create Date: 2026-10-16 13:21:05.871342
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c7d2a9e4b18"
+down_revision: Union[str, None] = "8d2e4b6a1f93"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A track should only be in a station's history once, but nothing
+    #  enforced that. Fold any duplicates into the newest row first,
+    #  keeping a thumbs down from any of them and the latest time.
+    op.execute(
+        """
+        UPDATE track_history
+        SET is_thumbs_downed = (
+                SELECT MAX(t.is_thumbs_downed) FROM track_history t
+                WHERE t.station_id = track_history.station_id
+                  AND t.track_id = track_history.track_id
+            ),
+            updated_at = (
+                SELECT MAX(t.updated_at) FROM track_history t
+                WHERE t.station_id = track_history.station_id
+                  AND t.track_id = track_history.track_id
+            )
+        WHERE id IN (
+            SELECT MAX(id) FROM track_history
+            WHERE track_id IS NOT NULL
+            GROUP BY station_id, track_id
+            HAVING COUNT(*) > 1
+        )
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM track_history
+        WHERE track_id IS NOT NULL
+          AND id NOT IN (
+            SELECT MAX(id) FROM track_history
+            WHERE track_id IS NOT NULL
+            GROUP BY station_id, track_id
+          )
+        """
+    )
+
+    op.create_index(
+        "ix_track_history_station_track",
+        "track_history",
+        ["station_id", "track_id"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_track_history_station_track", table_name="track_history")
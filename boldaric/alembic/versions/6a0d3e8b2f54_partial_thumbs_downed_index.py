@@ -0,0 +1,40 @@
+"""partial thumbs downed index
+
+Revision ID: 6a0d3e8b2f54
+Revises: e41f7a2c9d06
+Create Date: 2026-10-16 15:32:47.118903
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6a0d3e8b2f54"
+down_revision: Union[str, None] = "e41f7a2c9d06"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Only a few tracks are ever thumbs downed, so index just those
+    #  rows instead of every row in the history
+    op.drop_index("ix_track_history_station_thumbs_updated", table_name="track_history")
+    op.create_index(
+        "ix_track_history_thumbs_downed",
+        "track_history",
+        ["station_id", "updated_at"],
+        sqlite_where=sa.text("is_thumbs_downed = 1"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_track_history_thumbs_downed", table_name="track_history")
+    op.create_index(
+        "ix_track_history_station_thumbs_updated",
+        "track_history",
+        ["station_id", "is_thumbs_downed", "updated_at"],
+    )
@@ -0,0 +1,33 @@
+"""add embedding to tracks
+
+Revision ID: 8d2e4b6a1f93
+Revises: 3f9a1c2d7e60
+Create Date: 2026-10-16 10:02:17.540916
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8d2e4b6a1f93"
+down_revision: Union[str, None] = "3f9a1c2d7e60"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Store the precomputed (normalized) embedding of each track.
+    #  Existing tracks are filled in lazily the first time they are used.
+    with op.batch_alter_table("tracks") as batch_op:
+        batch_op.add_column(sa.Column("embedding", sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column("embedding_version", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("tracks") as batch_op:
+        batch_op.drop_column("embedding_version")
+        batch_op.drop_column("embedding")
@@ -0,0 +1,39 @@
+"""add track history indexes
+
+Revision ID: 9b3e6f1c2a75
+Revises: 5c7d2a9e4b18
+Create Date: 2026-10-16 13:58:40.217734
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9b3e6f1c2a75"
+down_revision: Union[str, None] = "5c7d2a9e4b18"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The history getters filter on the station and sort by time,
+    #  so these let SQLite walk the index instead of scanning and
+    #  sorting the whole table
+    op.create_index(
+        "ix_track_history_station_updated",
+        "track_history",
+        ["station_id", "updated_at"],
+    )
+    op.create_index(
+        "ix_track_history_station_thumbs_updated",
+        "track_history",
+        ["station_id", "is_thumbs_downed", "updated_at"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_track_history_station_thumbs_updated", table_name="track_history")
+    op.drop_index("ix_track_history_station_updated", table_name="track_history")
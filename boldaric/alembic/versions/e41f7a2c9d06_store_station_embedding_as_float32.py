@@ -0,0 +1,54 @@
+"""store station embedding as float32
+
+Revision ID: e41f7a2c9d06
+Revises: 9b3e6f1c2a75
+Create Date: 2026-10-16 14:41:12.504117
+
+"""
+
+from typing import Sequence, Union
+import pickle
+
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e41f7a2c9d06"
+down_revision: Union[str, None] = "9b3e6f1c2a75"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _convert(convert) -> None:
+    # The column is a BLOB either way, only what is in it changes
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text(
+            "SELECT id, current_embedding FROM stations "
+            "WHERE current_embedding IS NOT NULL"
+        )
+    ).fetchall()
+
+    updates = [{"id": id, "embedding": convert(blob)} for id, blob in rows]
+    if updates:
+        conn.execute(
+            sa.text(
+                "UPDATE stations SET current_embedding = :embedding WHERE id = :id"
+            ),
+            updates,
+        )
+
+
+def upgrade() -> None:
+    # Pickled list of floats -> raw float32 bytes
+    _convert(lambda blob: np.asarray(pickle.loads(blob), dtype=np.float32).tobytes())
+
+
+def downgrade() -> None:
+    _convert(
+        lambda blob: pickle.dumps(
+            np.frombuffer(blob, dtype=np.float32).tolist(), pickle.HIGHEST_PROTOCOL
+        )
+    )
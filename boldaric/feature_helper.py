@@ -10,6 +10,8 @@
 #  primary key. This class allows inserting and updating track
 #  embeddings, along with lookup, and similarity searches.
 
+import operator
+
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 from .models.track import Track
@@ -17,49 +19,83 @@ from .models.track import Track
 # Keep track of the version
 #  If we ever change normalization or embed
 #  we'll update this
-VERSION = 2
+#
+# 3: stored embeddings are float16
+VERSION = 3
 
+# The dtype stored embeddings are encoded with. Half precision is
+#  plenty for similarity and halves what we read back from the db.
+STORED_DTYPE = np.float16
 
-def track_to_embeddings(track: Track) -> list[float]:
-    """Convert the meteadata from a track into an embedding
-    for chromadb"""
 
-    # !mwd - Unlike what I was doing previously in
-    # features_to_embeddings, I am NOT normalizing any of these
-    # values here.
+# Layout of the 148 dimension embedding
+GENRE_DIMENSIONS = 128
+MFCC_DIMENSIONS = 13
+GROOVE_DIMENSIONS = 2
+MOOD_DIMENSIONS = 5
+DIMENSIONS = GENRE_DIMENSIONS + MFCC_DIMENSIONS + GROOVE_DIMENSIONS + MOOD_DIMENSIONS
+
+_GENRE = slice(0, GENRE_DIMENSIONS)
+_MFCC = slice(_GENRE.stop, _GENRE.stop + MFCC_DIMENSIONS)
+_GROOVE = slice(_MFCC.stop, _MFCC.stop + GROOVE_DIMENSIONS)
+_MOOD = slice(_GROOVE.stop, _GROOVE.stop + MOOD_DIMENSIONS)
 
-    embedding = []
+# The groove and mood features are fixed scalar columns on the track,
+#  so fetch them all at once in a single call
+_get_groove_and_mood = operator.attrgetter(
+    "groove_danceability",
+    "groove_tempo_stability",
+    "mood_aggressiveness",
+    "mood_happiness",
+    "mood_partiness",
+    "mood_relaxedness",
+    "mood_sadness",
+)
+
+
+def _l2_norm(v: np.ndarray) -> float:
+    # A plain dot product skips the generic dispatch in np.linalg.norm
+    return float(np.sqrt(np.dot(v, v)))
+
+
+def _fill_embedding(track: Track, out: np.ndarray) -> np.ndarray:
+    """Copy the raw (un-normalized) features of a track into `out`.
+
+    Everything is written directly into the preallocated buffer, so
+    we don't build up an intermediate python list."""
 
     # 1. Genre Embeddings (128D)
-    genre_embeds = np.array(track.genre_embedding_array).flatten()
+    genre_embeds = track.genre_embedding_array
+    n = min(len(genre_embeds), GENRE_DIMENSIONS)
+    out[:n] = genre_embeds[:n]
     # This shouldn't happen, but make sure we are at 128
-    genre_embeds = (
-        genre_embeds[:128]
-        if len(genre_embeds) >= 128
-        else np.pad(genre_embeds, (0, 128 - len(genre_embeds)))
-    )
-    embedding.extend(genre_embeds.tolist())
+    if n < GENRE_DIMENSIONS:
+        out[n:GENRE_DIMENSIONS] = 0.0
 
     # 2. MFCC features (13D)
-    mfcc_means = np.array(track.mfcc_mean_array)[:13]
-    embedding.extend(mfcc_means.tolist())
+    mfcc_means = track.mfcc_mean_array
+    n = min(len(mfcc_means), MFCC_DIMENSIONS)
+    out[_MFCC.start : _MFCC.start + n] = mfcc_means[:n]
+    if n < MFCC_DIMENSIONS:
+        out[_MFCC.start + n : _MFCC.stop] = 0.0
 
-    # 3. Groove features (2D)
-    danceability = track.groove_danceability
-    tempo_stability = track.groove_tempo_stability
-    embedding.extend([danceability, tempo_stability])
+    # 3. Groove features (2D) and 4. Mood features (5D)
+    out[_GROOVE.start : _MOOD.stop] = _get_groove_and_mood(track)
 
-    # 4. Mood features (5D)
-    mood_features = [
-        track.mood_aggressiveness,
-        track.mood_happiness,
-        track.mood_partiness,
-        track.mood_relaxedness,
-        track.mood_sadness,
-    ]
-    embedding.extend(mood_features)
+    return out
 
-    return embedding
+
+def track_to_embeddings(track: Track) -> list[float]:
+    """Convert the meteadata from a track into an embedding
+    for chromadb"""
+
+    # !mwd - Unlike what I was doing previously in
+    # features_to_embeddings, I am NOT normalizing any of these
+    # values here.
+
+    embedding = _fill_embedding(track, np.empty(DIMENSIONS, dtype=np.float32))
+
+    return embedding.tolist()
 
 
 ##
@@ -69,47 +105,36 @@ def track_to_embeddings_default_normalization(track: Track) -> list[float]:
     """Convert the meteadata from a track into an embedding
     for chromadb using the old (default) normalization"""
 
-    embedding = []
+    return _default_normalization(track).tolist()
+
+
+def _default_normalization(track: Track) -> np.ndarray:
+    embedding = _fill_embedding(track, np.empty(DIMENSIONS, dtype=np.float32))
 
     # 1. Genre Embeddings (128D)
-    genre_embeds = np.array(track.genre_embedding_array).flatten()
-    # This shouldn't happen, but make sure we are at 128
-    genre_embeds = (
-        genre_embeds[:128]
-        if len(genre_embeds) >= 128
-        else np.pad(genre_embeds, (0, 128 - len(genre_embeds)))
-    )
     # Do some normalization, otherwise this
     #  may dominate other features in lookups
-    genre_norm = np.linalg.norm(genre_embeds)
+    genre_embeds = embedding[_GENRE]
+    genre_norm = _l2_norm(genre_embeds)
     if genre_norm > 1e-9:
-        genre_embeds = genre_embeds / genre_norm
-    embedding.extend(genre_embeds.tolist())
+        genre_embeds /= genre_norm
 
     # 2. MFCC features (13D)
-    mfcc_means = np.array(track.mfcc_mean_array)[:13]
     # Normalize the entire MFCC vector rather than per-feature
-    norm = np.linalg.norm(mfcc_means)
+    mfcc_means = embedding[_MFCC]
+    norm = _l2_norm(mfcc_means)
     if norm > 1e-9:
-        mfcc_means = mfcc_means / norm
-    embedding.extend(mfcc_means.tolist())
+        mfcc_means /= norm
 
-    # 3. Groove features (2D)
-    danceability = track.groove_danceability
-    tempo_stability = track.groove_tempo_stability
-    embedding.extend([danceability, tempo_stability])
+    # 3. Groove features (2D) are used as is
 
     # 4. Mood features (5D)
-    mood_features = [
-        track.mood_aggressiveness,
-        track.mood_happiness,
-        track.mood_partiness,
-        track.mood_relaxedness,
-        track.mood_sadness,
-    ]
-    # Apply sigmoid activation
-    mood_features = 1 / (1 + np.exp(-np.array(mood_features)))
-    embedding.extend(mood_features.tolist())
+    # Apply sigmoid activation, in place over the whole mood slice
+    mood_features = embedding[_MOOD]
+    np.negative(mood_features, out=mood_features)
+    np.exp(mood_features, out=mood_features)
+    mood_features += 1.0
+    np.reciprocal(mood_features, out=mood_features)
 
     # !mwd - My AI Agent suggest that I should have been
     #  normalizing the full embedding in additional to normalizing
@@ -119,7 +144,40 @@ def track_to_embeddings_default_normalization(track: Track) -> list[float]:
     #  embeddings.
     #
     # Normalize the full embedding vector
-    embedding = np.array(embedding)
-    embedding /= np.linalg.norm(embedding)
+    embedding /= _l2_norm(embedding)
 
-    return embedding.tolist()
+    return embedding
+
+
+##
+# The default normalized embedding is stored on the track, so
+#  we only have to compute it once. It is tagged with VERSION so
+#  that bumping the version invalidates everything that was
+#  previously stored.
+def has_stored_embeddings(track: Track) -> bool:
+    """Check if the track has an up-to-date stored embedding"""
+    return track.embedding is not None and track.embedding_version == VERSION
+
+
+def store_embeddings(track: Track) -> np.ndarray:
+    """Compute the default normalized embedding and store it on the track.
+
+    This only updates the model, the caller is responsible for
+    committing it."""
+    embedding = _default_normalization(track).astype(STORED_DTYPE)
+    # Stored embeddings are read back without checking their size,
+    #  so this is the one place that has to get it right
+    assert embedding.shape == (DIMENSIONS,)
+    track.embedding = embedding.tobytes()
+    track.embedding_version = VERSION
+    # Hand back what was stored, so callers see the same values
+    #  whether or not the embedding was already on the track
+    return embedding.astype(np.float32)
+
+
+def get_track_embeddings(track: Track) -> np.ndarray:
+    """Get the default normalized embedding for a track, using
+    the stored one if it is up-to-date"""
+    if has_stored_embeddings(track):
+        return np.frombuffer(track.embedding, dtype=STORED_DTYPE).astype(np.float32)
+    return store_embeddings(track)
@@ -1,4 +1,12 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, PickleType
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Boolean,
+    Float,
+    ForeignKey,
+    LargeBinary,
+)
 from sqlalchemy.orm import relationship
 
 from . import Base
@@ -15,7 +23,8 @@ class Station(Base):
     replay_song_cooldown = Column(Integer, default=0)
     replay_artist_downrank = Column(Float, default=0.995)
     ignore_live = Column(Boolean, default=False)
-    current_embedding = Column(PickleType)
+    # float32 bytes
+    current_embedding = Column(LargeBinary)
 
     # Relationships
     user = relationship("User", back_populates="stations")
@@ -1,3 +1,5 @@
+import functools
+
 from sqlalchemy import Column, Integer, String, Float, DateTime, LargeBinary, ForeignKey
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
@@ -54,6 +56,9 @@ class Track(Base):
     spectral_character_brightness = Column(Float)
     spectral_character_contrast_mean = Column(Float)
     spectral_character_valley_std = Column(Float)
+    # The default normalized embedding, see feature_helper.VERSION
+    embedding = Column(LargeBinary)
+    embedding_version = Column(Integer)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
@@ -63,27 +68,29 @@ class Track(Base):
         "TrackHistory", back_populates="track"
     )  # Added relationship
 
-    @hybrid_property
+    # The array blobs never change once a track is extracted, so
+    #  decode them once and keep the result on the instance.
+    @functools.cached_property
     def genre_embedding_array(self) -> Optional[np.ndarray]:
         """Get the genre embedding as a numpy array"""
         if self.genre_embedding is None:
             return None
-        return np.frombuffer(bytes(self.genre_embedding), dtype=np.float64)
+        return np.frombuffer(bytes(self.genre_embedding), dtype=np.float32)
 
-    @hybrid_property
+    @functools.cached_property
     def mfcc_mean_array(self) -> Optional[np.ndarray]:
         """Get the mfcc mean as a numpy array"""
         if self.mfcc_mean is None:
             return None
-        return np.frombuffer(bytes(self.mfcc_mean), dtype=np.float64)
+        return np.frombuffer(bytes(self.mfcc_mean), dtype=np.float32)
 
-    @hybrid_property
+    @functools.cached_property
     def mfcc_covariance_array(self) -> Optional[np.ndarray]:
         """Get the mfcc covariance as a numpy array"""
         if self.mfcc_covariance is None:
             return None
         # Assuming a 13x13 covariance matrix for MFCC features
-        return np.frombuffer(bytes(self.mfcc_covariance), dtype=np.float64).reshape(
+        return np.frombuffer(bytes(self.mfcc_covariance), dtype=np.float32).reshape(
             (13, 13)
         )
 
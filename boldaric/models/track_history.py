@@ -1,12 +1,22 @@
-from sqlalchemy import Column, Integer, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 
 from . import Base
 
 
 class TrackHistory(Base):
     __tablename__ = "track_history"
+    __table_args__ = (
+        Index("ix_track_history_station_track", "station_id", "track_id", unique=True),
+        Index("ix_track_history_station_updated", "station_id", "updated_at"),
+        Index(
+            "ix_track_history_thumbs_downed",
+            "station_id",
+            "updated_at",
+            sqlite_where=text("is_thumbs_downed = 1"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     station_id = Column(Integer, ForeignKey("stations.id"), nullable=False)
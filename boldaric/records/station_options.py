@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class StationOptions:
     replay_song_cooldown: int = 0
     replay_artist_downrank: float = 0.995
@@ -10,15 +10,18 @@
 
 from aiohttp import web
 import asyncio
-import multiprocessing
+import concurrent.futures
 
 import argparse
+import functools
 import os
 import hashlib
 import logging
-import random
 import traceback
 
+import numpy as np
+import orjson
+
 from pydantic import BaseModel, ValidationError, Field
 from typing import Optional
 
@@ -30,20 +33,14 @@ import boldaric.subsonic
 from boldaric.utils import get_logger
 from boldaric.records.station_options import StationOptions
 
-# Development mode path
-DEV_RESOURCES = Path(__file__).parent.parent / "resources"
-
-# Installed mode path (system-wide: /usr/share/my_project/resources)
-INSTALLED_RESOURCES = Path("/usr/share") / "my_project" / "resources"
-
-# Choose appropriate path based on environment
-resources_path = DEV_RESOURCES if os.path.exists(DEV_RESOURCES) else INSTALLED_RESOURCES
-
 DEFAULT_RATING = 3
 SEED_RATING = 8
 THUMBS_UP_RATING = 5
 THUMBS_DOWN_RATING = -3
 
+# How many of the most recently played tracks have their artist downranked
+RECENT_ARTISTS = 15
+
 
 routes = web.RouteTableDef()
 
@@ -62,102 +59,198 @@ class UpdateStationParams(BaseModel):
     ignore_live: bool = Field(default=False)
 
 
+def json_response(data, status: int = 200) -> web.Response:
+    """Like web.json_response, but serialized with orjson"""
+    return web.Response(
+        body=orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        content_type="application/json",
+    )
+
+
 def get_next_songs(
-    db,
+    db: boldaric.VectorDB,
     conn,
-    pool,
     station_options: StationOptions,
-    history: list,
+    history: boldaric.simulator.History,
     played: list[boldaric.models.track_history.TrackHistory],
     thumbs_downed: list[boldaric.models.track_history.TrackHistory],
 ) -> list[dict]:
     logger = get_logger()
     logger.debug("get_next_song")
 
-    # Both played and thumbs_downed are lists of TrackHistory models
-    chunksize = (len(history) + pool._processes - 1) // pool._processes
+    # With no history there is nothing to attract towards, and the
+    #  simulation only gives back NaNs, so don't query with them
+    if history.size == 0:
+        return []
 
-    new_embeddings = boldaric.simulator.attract(pool, history, chunksize)
+    # Both played and thumbs_downed are lists of TrackHistory models,
+    #  played is most recent first
+    new_embeddings = boldaric.simulator.attract(history)
 
     # query similar
-    ignore_list = []
-    # ignore ALL thumbs downed
-    ignore_list.extend([(x.track.artist, x.track.title) for x in thumbs_downed])
-    # ignore last X played
+    # ignore ALL thumbs downed, and the last X played
     replay_song_cooldown = station_options.replay_song_cooldown
-    ignore_list.extend(
-        [(x.track.artist, x.track.title) for x in played[-replay_song_cooldown:]]
+    ignored = [*thumbs_downed, *played[:replay_song_cooldown]]
+    ignore_songs = {(x.track.artist, x.track.title) for x in ignored}
+    ignore_ids = {x.track.subsonic_id for x in ignored if x.track.subsonic_id}
+    logger.debug("ignoring %d: %r", replay_song_cooldown, ignore_songs)
+
+    tracks = db.query_similar(
+        new_embeddings,
+        n_results=45,
+        ignore_songs=ignore_songs,
+        ignore_ids=ignore_ids,
+        # only tracks that have subsonic info
+        require_subsonic_id=True,
     )
-    logger.debug(f"ignoring {station_options.replay_song_cooldown}: {ignore_list}")
-
-    tracks = db.query_similar(new_embeddings, n_results=45, ignore_songs=ignore_list)
 
     # resort these, and slightly downvote recent artists
-    recent_artists = [x.track.artist for x in played[-15:]]
+    recent_artists = {x.track.artist for x in played[:RECENT_ARTISTS]}
     logger.debug(
-        f"Downranking Recent artists ({station_options.replay_artist_downrank}): {recent_artists}"
+        "Downranking Recent artists (%s): %r",
+        station_options.replay_artist_downrank,
+        recent_artists,
     )
 
-    def update_similarity(t):
-        replay_artist_downrank = station_options.replay_artist_downrank
-        similarity = (
-            replay_artist_downrank if t["metadata"]["artist"] in recent_artists else 1.0
-        )
-        logger.debug(
-            f"similarity for {t['metadata']['artist']} {t['metadata']['title']} is {similarity}"
-        )
-        return {**t, "similarity": t["similarity"] * similarity}
-
-    tracks = list(map(update_similarity, tracks))
-    # Sort by similarity
-    tracks.sort(key=lambda x: -x["similarity"])
-
-    # return all tracks that have subsonic info
-    tracks = list(
-        filter(
-            lambda t: "subsonic_id" in t["metadata"]
-            and t["metadata"]["subsonic_id"] not in (None, ""),
-            tracks,
-        )
+    # Rescore the whole candidate set at once: downrank recent artists
+    #  with a mask built from set lookups, then order by the scores.
+    similarities = np.fromiter(
+        (t["similarity"] for t in tracks), dtype=np.float64, count=len(tracks)
+    )
+    is_recent = np.fromiter(
+        (t["metadata"]["artist"] in recent_artists for t in tracks),
+        dtype=bool,
+        count=len(tracks),
     )
+    similarities[is_recent] *= station_options.replay_artist_downrank
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for t, recent in zip(tracks, is_recent):
+            downrank = station_options.replay_artist_downrank if recent else 1.0
+            logger.debug(
+                "similarity for %s %s is %s",
+                t["metadata"]["artist"],
+                t["metadata"]["title"],
+                downrank,
+            )
 
-    possible_tracks = [
-        (x["metadata"]["artist"], x["metadata"]["title"], x["similarity"])
-        for x in tracks
-    ]
-    logger.debug(f"Possible tracks {possible_tracks}")
+    # Sort by similarity. query_similar hands us fresh dicts, so
+    #  update them in place as we go.
+    order = np.argsort(-similarities, kind="stable")
+    tracks = [tracks[i] for i in order]
+    for t, similarity in zip(tracks, similarities[order].tolist()):
+        t["similarity"] = similarity
+
+    if logger.isEnabledFor(logging.DEBUG):
+        possible_tracks = [
+            (x["metadata"]["artist"], x["metadata"]["title"], x["similarity"])
+            for x in tracks
+        ]
+        logger.debug("Possible tracks %r", possible_tracks)
 
     return tracks
 
 
+def pick_tracks(tracks: list[dict], k: int) -> list[dict]:
+    """Randomly pick up to k different tracks, weighted by similarity"""
+    if len(tracks) == 0:
+        return []
+
+    # Anything with a negative similarity can't be picked, unless
+    #  that's all there is
+    weights = np.fromiter(
+        (t["similarity"] for t in tracks), dtype=np.float64, count=len(tracks)
+    )
+    np.maximum(weights, 0.0, out=weights)
+    total = weights.sum()
+    if total > 0:
+        size = min(k, np.count_nonzero(weights))
+        p = weights / total
+    else:
+        size = min(k, len(tracks))
+        p = None
+
+    picks = np.random.choice(len(tracks), size=size, replace=False, p=p)
+    return [tracks[i] for i in picks]
+
+
+def _record_track_sync(
+    station_db: boldaric.StationDB,
+    station_id: str,
+    song_id: str,
+    rating: int,
+    thumbs_down: bool,
+) -> int:
+    track_id = station_db.get_track_id_by_subsonic_id(song_id)
+    if track_id is None:
+        raise ValueError(f"Unknown song_id {song_id}")
+    station_db.add_track_id_to_or_update_history(
+        station_id, track_id, thumbs_down, rating
+    )
+    return track_id
+
+
+async def _record_track(
+    app: web.Application,
+    station_id: str,
+    song_id: str,
+    rating: int,
+    thumbs_down: bool = False,
+) -> int:
+    """Look up a track and add it to a station's history, returning
+    the track's id.
+
+    This runs on the db executor, so it doesn't block the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(
+        app["db_executor"],
+        _record_track_sync,
+        app["station_db"],
+        station_id,
+        song_id,
+        rating,
+        thumbs_down,
+    )
+
+
+# A user's token never changes for a given salt, so only compute it once
+@functools.lru_cache(maxsize=4096)
+def make_token(salt: bytes, username: str) -> bytes:
+    """Generate the raw 32 byte auth token for a user.
+
+    Clients see it hex encoded."""
+    # Keyed blake2b is a proper MAC over the username, and is a single
+    #  primitive instead of hashing salt + username.
+    return hashlib.blake2b(username.encode("utf-8"), key=salt, digest_size=32).digest()
+
+
+def build_user_tokens(station_db: boldaric.StationDB, salt: bytes) -> dict[bytes, dict]:
+    """Build a lookup table of raw auth token -> user"""
+    return {
+        make_token(salt, x.username): {"id": x.id, "username": x.username}
+        for x in station_db.get_all_users()
+    }
+
+
 @web.middleware
-async def auth_middleware(request, handler):
+async def auth_middleware(request: web.Request, handler) -> web.StreamResponse:
     # Skip auth for non-api routes and the auth endpoint
     if not request.path.startswith("/api") or request.path == "/api/auth":
         return await handler(request)
 
-    # salt
-    salt = request.app["salt"]
-    user_salts = dict(
-        [
-            (
-                hashlib.sha256(salt + x.username.encode("utf-8")).hexdigest(),
-                {"id": x.id, "username": x.username},
-            )
-            for x in request.app["station_db"].get_all_users()
-        ]
-    )
-
     # For all other routes, require Authorization header
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
-        return web.json_response({"error": "Unauthorized"}, status=401)
+        return json_response({"error": "Unauthorized"}, status=401)
 
-    auth_token = auth_header[7:]
+    try:
+        auth_token = bytes.fromhex(auth_header[7:])
+    except ValueError:
+        return json_response({"error": "Unauthorized"}, status=401)
 
-    user = user_salts.get(auth_token)
+    user = request.app["user_tokens"].get(auth_token)
     if not user:
-        return web.json_response({"error": "Unauthorized"}, status=401)
+        return json_response({"error": "Unauthorized"}, status=401)
 
     # Store this user in the request
     request["user"] = user
@@ -171,28 +264,65 @@ async def auth(request):
         data = await request.json()
         login = data["login"].strip()
 
+        salt = request.app["salt"]
+        user_tokens = request.app["user_tokens"]
+
+        # Known users are already in the token table, so we
+        #  don't need to go to the database
+        token = make_token(salt, login)
+        known_user = user_tokens.get(token)
+        if known_user:
+            return json_response({"token": token.hex(), **known_user})
+
         # verify
-        user = request.app["station_db"].get_user(login)
+        user = await asyncio.get_running_loop().run_in_executor(
+            request.app["db_executor"], request.app["station_db"].get_user, login
+        )
         if user:
             # make a token
-            salt = request.app["salt"]
-            token = hashlib.sha256(salt + user.username.encode("utf-8")).hexdigest()
+            token = make_token(salt, user.username)
+            # remember it, this user was created after startup
+            user_tokens[token] = {
+                "id": user.id,
+                "username": user.username,
+            }
 
-            return web.json_response(
-                {"token": token, "id": user.id, "username": user.username}
+            return json_response(
+                {"token": token.hex(), "id": user.id, "username": user.username}
             )
         else:
-            return web.json_response({"error": "Unauthorized"}, status=401)
+            return json_response({"error": "Unauthorized"}, status=401)
     except Exception as e:
         logger = get_logger()
         logger.error(f"Error in auth: {str(e)}\n{traceback.format_exc()}")
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
+
+
+def _stations_etag(app: web.Application, user_id: int) -> str:
+    # The version only moves when this server changes a user's
+    #  stations, and the epoch keeps tags from an earlier run from
+    #  matching after a restart.
+    version = app["stations_versions"].get(user_id, 0)
+    return f'W/"{user_id}-{version}-{app["stations_epoch"]}"'
+
+
+def _bump_stations_version(app: web.Application, user_id: int) -> None:
+    versions = app["stations_versions"]
+    versions[user_id] = versions.get(user_id, 0) + 1
 
 
 @routes.get("/api/stations")
 async def get_stations(request):
     try:
         user = request["user"]
+
+        # The station list rarely changes, so let clients that already
+        #  have it skip the query and the body
+        etag = _stations_etag(request.app, user["id"])
+        if_none_match = request.headers.get("If-None-Match", "")
+        if etag in (t.strip() for t in if_none_match.split(",")):
+            return web.Response(status=304, headers={"ETag": etag})
+
         stations = request.app["station_db"].get_stations_for_user(user["id"])
 
         # Convert Station models to dictionaries for JSON serialization
@@ -208,15 +338,17 @@ async def get_stations(request):
             for station in stations
         ]
 
-        return web.json_response(stations_dict)
+        response = json_response(stations_dict)
+        response.headers["ETag"] = etag
+        return response
     except Exception as e:
         logger = get_logger()
         logger.error(f"Error in get_stations: {str(e)}\n{traceback.format_exc()}")
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 @routes.post("/api/stations")
-async def make_station(request):
+async def make_station(request: web.Request) -> web.Response:
     try:
         station_db = request.app["station_db"]
         user = request["user"]
@@ -225,35 +357,39 @@ async def make_station(request):
         data = await request.json()
 
         try:
-            params = CreateStationParams(
-                **{
-                    k: v
-                    for k, v in data.items()
-                    if k in CreateStationParams.model_fields
-                }
-            )
+            params = CreateStationParams.model_validate(data)
         except ValidationError as e:
-            return web.json_response({"error": e.errors()}, status=400)
+            return json_response({"error": e.errors()}, status=400)
 
-        track = station_db.get_track_by_subsonic_id(params.song_id)
+        track = await asyncio.get_running_loop().run_in_executor(
+            request.app["db_executor"],
+            station_db.get_track_by_subsonic_id,
+            params.song_id,
+        )
         if not track:
-            return web.json_response({"error": "Invalid `song_id`"}, status=400)
-
-        station_id = station_db.create_station(user["id"], params.station_name)
-        # set properties
-        station_db.set_station_options(
-            station_id,
-            params.replay_song_cooldown,
-            params.replay_artist_downrank,
-            params.ignore_live,
+            return json_response({"error": "Invalid `song_id`"}, status=400)
+
+        # Create the station, set its properties, and seed it
+        #  in one transaction
+        station_id = await asyncio.get_running_loop().run_in_executor(
+            request.app["db_executor"],
+            station_db.create_station_with_seed,
+            user["id"],
+            params.station_name,
+            StationOptions(
+                replay_song_cooldown=params.replay_song_cooldown,
+                replay_artist_downrank=params.replay_artist_downrank,
+                ignore_live=params.ignore_live,
+            ),
+            track,
+            SEED_RATING,
         )
-
-        station_db.add_track_to_or_update_history(station_id, track, False, SEED_RATING)
+        _bump_stations_version(request.app, user["id"])
 
         stream_url = boldaric.subsonic.make_stream_link(sub_conn, track.subsonic_id)
         cover_url = boldaric.subsonic.make_album_art_link(sub_conn, track.subsonic_id)
 
-        return web.json_response(
+        return json_response(
             {
                 "station": {"id": station_id, "name": params.station_name},
                 "track": {
@@ -269,66 +405,70 @@ async def make_station(request):
     except Exception as e:
         logger = get_logger()
         logger.error(f"Error in make_station: {str(e)}\n{traceback.format_exc()}")
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 @routes.get("/api/station/{station_id}")
-async def get_next_song_for_station(request):
+async def get_next_song_for_station(request: web.Request) -> web.Response:
     try:
         vec_db = request.app["vec_db"]
         station_db = request.app["station_db"]
         sub_conn = request.app["sub_conn"]
-        pool = request.app["pool"]
+        db_executor = request.app["db_executor"]
         loop = asyncio.get_running_loop()
 
         station_id = request.match_info["station_id"]
 
-        # make our history...
-        history = station_db.get_embedding_history(station_id)
-
-        station_options: StationOptions = station_db.get_station_options(station_id)
+        station_options: StationOptions = await loop.run_in_executor(
+            db_executor, station_db.get_station_options, station_id
+        )
 
-        # load up the track history
-        thumbs_downed = station_db.get_thumbs_downed_history(station_id)
-        # get most recent 100
-        played = station_db.get_track_history(
-            station_id, max(100, station_options.replay_song_cooldown)
+        # The history queries are independent, so run them concurrently
+        #  on the db pool instead of one after another on the event loop.
+        history, thumbs_downed, played = await asyncio.gather(
+            # make our history...
+            loop.run_in_executor(
+                db_executor, station_db.get_embedding_history, station_id
+            ),
+            # load up the track history
+            loop.run_in_executor(
+                db_executor, station_db.get_thumbs_downed_history, station_id
+            ),
+            # get the most recent tracks, newest first. We only need
+            #  enough for the cooldown and the recent artists
+            loop.run_in_executor(
+                db_executor,
+                station_db.get_track_history,
+                station_id,
+                max(RECENT_ARTISTS, station_options.replay_song_cooldown),
+            ),
         )
-        # reverse the order
-        played.reverse()
 
         next_tracks = await loop.run_in_executor(
-            None,
-            lambda: get_next_songs(
-                vec_db, sub_conn, pool, station_options, history, played, thumbs_downed
-            ),
+            request.app["cpu_executor"],
+            get_next_songs,
+            vec_db,
+            sub_conn,
+            station_options,
+            history,
+            played,
+            thumbs_downed,
         )
 
         # grab 3 choices based upon similarity
-        def get_random(tracks):
-            if len(tracks) == 0:
-                return None
-
-            choice = random.choices(
-                tracks, weights=[item["similarity"] for item in tracks], k=1
-            )[0]
-            # modify the original list here
-            tracks.remove(choice)
-            return choice
-
-        top_tracks = [
-            get_random(next_tracks),
-            get_random(next_tracks),
-            get_random(next_tracks),
-        ]
-        top_tracks = [x for x in top_tracks if x is not None]
+        top_tracks = pick_tracks(next_tracks, 3)
 
         if len(top_tracks) > 0:
 
+            # Look up all of the chosen tracks at once
+            tracks_by_id = await loop.run_in_executor(
+                db_executor,
+                station_db.get_tracks_by_subsonic_ids,
+                [t["metadata"]["subsonic_id"] for t in top_tracks],
+            )
+
             def make_response(t):
-                track = station_db.get_track_by_subsonic_id(
-                    t["metadata"]["subsonic_id"]
-                )
+                track = tracks_by_id[t["metadata"]["subsonic_id"]]
                 stream_url = boldaric.subsonic.make_stream_link(
                     sub_conn, track.subsonic_id
                 )
@@ -345,19 +485,19 @@ async def get_next_song_for_station(request):
                     "cover_url": cover_url,
                 }
 
-            get_logger().debug(f"Next tracks: {top_tracks}")
-            return web.json_response(
+            get_logger().debug("Next tracks: %r", top_tracks)
+            return json_response(
                 {"tracks": list(map(lambda t: make_response(t), top_tracks))}
             )
         else:
             get_logger().debug("Unable to find any recommendations")
-            return web.json_response({"error": "Unable to find next song"}, status=400)
+            return json_response({"error": "Unable to find next song"}, status=400)
     except Exception as e:
         logger = get_logger()
         logger.error(
             f"Error in get_next_song_for_station: {str(e)}\n{traceback.format_exc()}"
         )
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 @routes.get("/api/station/{station_id}/info")
@@ -377,13 +517,13 @@ async def get_station_info(request):
                 "replay_artist_downrank": station.replay_artist_downrank,
                 "ignore_live": station.ignore_live,
             }
-            return web.json_response(station_dict)
+            return json_response(station_dict)
         else:
-            return web.json_response({"error": "Station not found"}, status=404)
+            return json_response({"error": "Station not found"}, status=404)
     except Exception as e:
         logger = get_logger()
         logger.error(f"Error in get_station_info: {str(e)}\n{traceback.format_exc()}")
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 @routes.put("/api/station/{station_id}/info")
@@ -396,15 +536,9 @@ async def update_station_info(request):
         data = await request.json()
 
         try:
-            params = UpdateStationParams(
-                **{
-                    k: v
-                    for k, v in data.items()
-                    if k in UpdateStationParams.model_fields
-                }
-            )
+            params = UpdateStationParams.model_validate(data)
         except ValidationError as e:
-            return web.json_response({"error": e.errors()}, status=400)
+            return json_response({"error": e.errors()}, status=400)
 
         # Update station options
         station_db.set_station_options(
@@ -413,6 +547,7 @@ async def update_station_info(request):
             params.replay_artist_downrank,
             params.ignore_live,
         )
+        _bump_stations_version(request.app, user["id"])
 
         # Get updated station to return current values
         station = station_db.get_station(user["id"], station_id)
@@ -425,104 +560,87 @@ async def update_station_info(request):
                 "replay_artist_downrank": station.replay_artist_downrank,
                 "ignore_live": station.ignore_live,
             }
-            return web.json_response(station_dict)
+            return json_response(station_dict)
         else:
-            return web.json_response({"error": "Station not found"}, status=404)
+            return json_response({"error": "Station not found"}, status=404)
     except Exception as e:
         logger = get_logger()
         logger.error(
             f"Error in update_station_info: {str(e)}\n{traceback.format_exc()}"
         )
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 @routes.post("/api/station/{station_id}/seed")
-async def add_seed(request):
+async def add_seed(request: web.Request) -> web.Response:
     try:
         data = await request.json()
 
-        station_db = request.app["station_db"]
-
         station_id = request.match_info["station_id"]
         song_id = data["song_id"].strip()
 
-        track = station_db.get_track_by_subsonic_id(song_id)
-        get_logger().debug(f"Adding seed track: {track}")
+        track_id = await _record_track(request.app, station_id, song_id, SEED_RATING)
+        get_logger().debug("Adding seed track: %s", track_id)
 
-        track_history_id = station_db.add_track_to_or_update_history(
-            station_id, track, False, SEED_RATING
-        )
-
-        return web.json_response({"success": True})
+        return json_response({"success": True})
     except Exception as e:
         logger = get_logger()
         logger.error(f"Error in add_seed: {str(e)}\n{traceback.format_exc()}")
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 @routes.put("/api/station/{station_id}/{song_id}")
-async def add_song_to_history(request):
+async def add_song_to_history(request: web.Request) -> web.Response:
     try:
-        station_db = request.app["station_db"]
-
         station_id = request.match_info["station_id"]
         song_id = request.match_info["song_id"]
 
-        track = station_db.get_track_by_subsonic_id(song_id)
-        get_logger().debug(f"Adding track history: {track}")
-        track_history_id = station_db.add_track_to_or_update_history(
-            station_id, track, False, DEFAULT_RATING
-        )
+        track_id = await _record_track(request.app, station_id, song_id, DEFAULT_RATING)
+        get_logger().debug("Adding track history: %s", track_id)
 
-        return web.json_response({"success": True})
+        return json_response({"success": True})
     except Exception as e:
         logger = get_logger()
         logger.error(
             f"Error in add_song_to_history: {str(e)}\n{traceback.format_exc()}"
         )
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 @routes.post("/api/station/{station_id}/{song_id}/thumbs_up")
-async def thumbs_up(request):
+async def thumbs_up(request: web.Request) -> web.Response:
     try:
-        station_db = request.app["station_db"]
-
         station_id = request.match_info["station_id"]
         song_id = request.match_info["song_id"]
 
-        track = station_db.get_track_by_subsonic_id(song_id)
-        get_logger().debug(f"Thumbs up track: {track}")
-        track_history_id = station_db.add_track_to_or_update_history(
-            station_id, track, False, THUMBS_UP_RATING
+        track_id = await _record_track(
+            request.app, station_id, song_id, THUMBS_UP_RATING
         )
+        get_logger().debug("Thumbs up track: %s", track_id)
 
-        return web.json_response({"success": True})
+        return json_response({"success": True})
     except Exception as e:
         logger = get_logger()
         logger.error(f"Error in thumbs_up: {str(e)}\n{traceback.format_exc()}")
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 @routes.post("/api/station/{station_id}/{song_id}/thumbs_down")
-async def thumbs_down(request):
+async def thumbs_down(request: web.Request) -> web.Response:
     try:
-        station_db = request.app["station_db"]
-
         station_id = request.match_info["station_id"]
         song_id = request.match_info["song_id"]
 
-        track = station_db.get_track_by_subsonic_id(song_id)
-        get_logger().debug(f"Thumbs down track: {track}")
-        track_history_id = station_db.add_track_to_or_update_history(
-            station_id, track, True, THUMBS_DOWN_RATING
+        track_id = await _record_track(
+            request.app, station_id, song_id, THUMBS_DOWN_RATING, thumbs_down=True
         )
+        get_logger().debug("Thumbs down track: %s", track_id)
 
-        return web.json_response({"success": True})
+        return json_response({"success": True})
     except Exception as e:
         logger = get_logger()
         logger.error(f"Error in thumbs_down: {str(e)}\n{traceback.format_exc()}")
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 @routes.get("/api/search")
@@ -532,13 +650,23 @@ async def search(request):
         artist = request.query["artist"]
         title = request.query["title"]
 
-        results = boldaric.subsonic.search_songs(sub_conn, f"{artist} {title}")
+        # The link builders never touch the network, but search does a
+        #  blocking HTTP round trip, so keep it off the event loop. It
+        #  goes on the default executor, so a slow subsonic server
+        #  can't tie up the threads the database reads need.
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            None,
+            boldaric.subsonic.search_songs,
+            sub_conn,
+            f"{artist} {title}",
+        )
 
-        return web.json_response(results)
+        return json_response(results)
     except Exception as e:
         logger = get_logger()
         logger.error(f"Error in search: {str(e)}\n{traceback.format_exc()}")
-        return web.json_response({"error": "Error processing request"}, status=500)
+        return json_response({"error": "Error processing request"}, status=500)
 
 
 def initialize_database(db_path):
@@ -594,9 +722,18 @@ async def go(db_path, port):
         os.getenv("NAVIDROME_PASSWORD"),
     )
 
-    # generate a common pool we'll use for multiprocessing
-    # Not creating/throwing this away speed things up
-    pool = multiprocessing.Pool()
+    # A bounded thread pool for blocking database calls, so they
+    #  never run on the event loop and can't oversubscribe it
+    db_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=os.cpu_count(), thread_name_prefix="db"
+    )
+
+    # The simulator releases the GIL while it runs, so threads are
+    #  enough to keep it off the event loop. Keep it separate from
+    #  the db pool so slow simulations don't hold up database calls.
+    cpu_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=os.cpu_count(), thread_name_prefix="cpu"
+    )
 
     # Generate a salt that we'll use for auth
     salt = os.urandom(16)
@@ -619,8 +756,18 @@ async def go(db_path, port):
     app["vec_db"] = vec_db
     app["station_db"] = station_db
     app["sub_conn"] = sub_conn
-    app["pool"] = pool
+    app["db_executor"] = db_executor
+    app["cpu_executor"] = cpu_executor
     app["salt"] = salt
+    # Per-user counters behind the /api/stations ETag
+    app["stations_versions"] = {}
+    app["stations_epoch"] = os.urandom(4).hex()
+    # Precompute the tokens once, so authenticating a request
+    #  is just a lookup
+    app["user_tokens"] = build_user_tokens(station_db, salt)
+
+    # Get the simulator ready before we take any requests
+    boldaric.simulator.warm_up()
 
     runner = web.AppRunner(app)
     await runner.setup()
@@ -8,87 +8,184 @@
 # This provides a RESTful API for creating stations, getting next
 # tracks for a stations, rating songs, seeding songs, and so on.
 
+import threading
+
+import numba
 import numpy as np
 
 
-def make_history():
-    # !mwd - I don't love how I am doing this
-    #  But, we essentially have 148 dimensions:
+class History:
+    # !mwd - We essentially have 148 dimensions:
     #  128 for genres
     #  13 fo mfcc
     #  2 for groove
     #  5 for mood
     #
-    # We'll create a list of 148 lists were each list will store the
-    #  history a tuple (value, weight) for a specific feature
+    # For each dimension we store the history of (value, weight)
+    #  points. They are kept as two (148, capacity) arrays, one for
+    #  the values and one for the weights, so the simulation can use
+    #  them directly. Each row is a dimension, and the first `size`
+    #  columns are filled in. The capacity doubles when it runs out.
 
-    return [[] for x in range(148)]
+    def __init__(self, capacity: int = 256, dimensions: int = 148):
+        self.values = np.empty((dimensions, capacity), dtype=np.float64)
+        self.attractions = np.empty((dimensions, capacity), dtype=np.float64)
+        self.size = 0
 
+    def __len__(self):
+        return self.size
 
-def add_history(history, feature_list, rank):
-    # The history is a 148 dimension list of lists
-    # Feature list is also 148 dimension
-    #  For each dimension, add a tuple of (value, rank)
-    assert len(history) == len(feature_list)
+    def append(self, feature_list, rank):
+        if self.size == self.values.shape[1]:
+            self._grow()
 
-    for i, feat in enumerate(feature_list):
-        history[i].append((feat, rank))
-    return history
+        self.values[:, self.size] = feature_list
+        self.attractions[:, self.size] = rank
+        self.size += 1
 
+    def extend(self, embeddings, ranks):
+        # Append several points at once. embeddings is (n, dimensions)
+        #  and ranks has one rank per point.
+        n = len(embeddings)
+        while self.size + n > self.values.shape[1]:
+            self._grow()
 
-def calculate_force(values, attractions, particle_position):
-    SIGMA_SQ_2 = 0.005  # 2 * 0.05**2
+        self.values[:, self.size : self.size + n] = np.asarray(embeddings).T
+        self.attractions[:, self.size : self.size + n] = ranks
+        self.size += n
 
-    # Calculate a new force based upon the points and their
-    #  attraction weights around our particle
+    def _grow(self):
+        capacity = max(1, self.values.shape[1] * 2)
+        for name in ("values", "attractions"):
+            old = getattr(self, name)
+            new = np.empty((old.shape[0], capacity), dtype=np.float64)
+            new[:, : self.size] = old[:, : self.size]
+            setattr(self, name, new)
 
-    distance = values - particle_position
-    exp_term = np.exp(-(distance**2) / SIGMA_SQ_2)
-    force = attractions * exp_term * np.sign(distance)
-    return np.sum(force)
 
+def make_history(capacity=256):
+    return History(capacity)
 
-def update_particle_position(
-    values, attractions, particle_position, velocity, time_step=0.001, damping=0.99
-):
-    # Step through our simulation of moving a particle
-    force = calculate_force(values, attractions, particle_position)
-    acceleration = force
-    velocity = velocity * damping + acceleration * time_step
-    particle_position += velocity * time_step
-    return particle_position, velocity
 
+def add_history(history, feature_list, rank):
+    # Feature list is 148 dimension
+    #  For each dimension, add a point of (value, rank)
+    assert history.values.shape[0] == len(feature_list)
 
-def run_simulation(points):
-    points_array = np.array(points)
-    values = points_array[:, 0]
-    attractions = points_array[:, 1]
-    central_point = np.mean(values)
+    history.append(feature_list, rank)
+    return history
 
-    # Give the particle just a little bit of randomness in its starting
-    #  position
-    particle_position = central_point + np.random.uniform(-0.01, 0.01)
 
+def add_history_batch(history, embeddings, ranks):
+    # Like add_history, but for a whole (n, 148) array of embeddings
+    #  with one rank for each of them
+    assert history.values.shape[0] == np.shape(embeddings)[1]
+
+    history.extend(embeddings, ranks)
+    return history
+
+
+# Simulation parameters
+SIGMA_SQ_2 = 0.005  # 2 * 0.05**2
+INV_SIGMA_SQ_2 = 1.0 / SIGMA_SQ_2
+TIME_STEP = 0.001
+TOTAL_TIME = 0.1
+ITERATIONS = int(TOTAL_TIME / TIME_STEP)
+DAMPING = 0.99
+
+
+@numba.njit(
+    "float64(float64[::1], float64[::1], float64)",
+    cache=True,
+    fastmath=True,
+    boundscheck=False,
+)
+def _simulate_dimension(values, attractions, offset):
+    # Drop a particle at the center of the points (plus a small
+    #  random offset), and step it along based upon the attraction
+    #  of the points around it.
+    #
+    # This is JIT compiled, so the force is computed in a single
+    #  pass over the points with no temporary arrays.
+    particle_position = values.mean() + offset
     velocity = 0.0
-    time_step = 0.001
-    total_time = 0.1
 
-    iterations = int(total_time / time_step)
-    prev_position = particle_position
+    for _ in range(ITERATIONS):
+        # Calculate a new force based upon the points and their
+        #  attraction weights around our particle
+        force = 0.0
+        for j in range(values.shape[0]):
+            distance = values[j] - particle_position
+            exp_term = np.exp(-(distance * distance) * INV_SIGMA_SQ_2)
+            # sign(distance) as a difference of comparisons, which
+            #  compiles to selects instead of a branch
+            sign = (distance > 0.0) - (distance < 0.0)
+            force += attractions[j] * exp_term * sign
+
+        prev_position = particle_position
+        velocity = velocity * DAMPING + force * TIME_STEP
+        particle_position += velocity * TIME_STEP
 
-    for _ in range(iterations):
-        particle_position, velocity = update_particle_position(
-            values, attractions, particle_position, velocity, time_step
-        )
         # Early stopping if converged
         if abs(particle_position - prev_position) < 1e-6 and abs(velocity) < 1e-6:
             break
-        prev_position = particle_position
 
     return particle_position
 
 
-def attract(pool, history, chunksize):
+@numba.njit(
+    "float64[::1](float64[:, ::1], float64[:, ::1], int64, float64[::1])",
+    cache=True,
+    fastmath=True,
+    nogil=True,
+    parallel=True,
+)
+def _simulate_dimensions(values, attractions, n, offsets):
+    # Every dimension is independent, so simulate them in parallel,
+    #  using the first n points of each one
+    positions = np.empty(values.shape[0])
+    for i in numba.prange(values.shape[0]):
+        positions[i] = _simulate_dimension(
+            values[i, :n], attractions[i, :n], offsets[i]
+        )
+    return positions
+
+
+# numba's default threading layer aborts if parallel code is
+#  entered from more than one thread at once, and the server runs
+#  simulations from its executor threads.
+_simulate_lock = threading.Lock()
+
+
+def run_simulations(values, attractions, n=None):
+    # Run the simulation for every dimension. values and attractions
+    #  are (dimensions, capacity), and only the first n points (all
+    #  of them by default) of each dimension are used. We get back
+    #  the final particle position for each dimension.
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    attractions = np.ascontiguousarray(attractions, dtype=np.float64)
+    if n is None:
+        n = values.shape[1]
+    if n == 0:
+        # There is no center to start from. Don't hand this to the
+        #  kernel, it is compiled with fastmath and won't give back a
+        #  reliable NaN for the mean of nothing.
+        return np.full(values.shape[0], np.nan)
+
+    # Give the particle just a little bit of randomness in its starting
+    #  position
+    offsets = np.random.uniform(-0.01, 0.01, size=len(values))
+
+    with _simulate_lock:
+        return _simulate_dimensions(values, attractions, n, offsets)
+
+
+def run_simulation(points):
+    points_array = np.asarray(points, dtype=np.float64)
+    return run_simulations(points_array[None, :, 0], points_array[None, :, 1])[0]
+
+
+def attract(history):
     # For all 148 of our feature dimension,
     #  we are going to run a simulation of dropping
     #  a particle near the center of the points in
@@ -96,4 +193,14 @@ def attract(pool, history, chunksize):
     #  based upon the attraction of other particles
     # That will give us a new position for each dimension
     #  to use as a similarity
-    return list(pool.imap(run_simulation, history, chunksize))
+    return run_simulations(history.values, history.attractions, history.size).tolist()
+
+
+def warm_up():
+    # The kernels are compiled when this module is imported (they
+    #  have explicit signatures), but the first parallel call still
+    #  has to start numba's thread pool. Do that with a tiny history,
+    #  so it isn't paid by the first request.
+    history = make_history(capacity=1)
+    add_history(history, np.zeros(148), 1)
+    attract(history)
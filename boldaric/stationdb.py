@@ -8,10 +8,15 @@
 # This provides a RESTful API for creating stations, getting next
 # tracks for a stations, rating songs, seeding songs, and so on.
 
-from typing import Optional, List, Tuple, Dict, Any
-from datetime import datetime, timedelta
+from typing import Optional, List, Tuple, Dict, Any, Iterable
+from collections import OrderedDict
+import contextlib
+import itertools
 import numpy as np
 import os
+import sqlite3
+import threading
+import urllib.parse
 
 from importlib import resources
 
@@ -22,9 +27,11 @@ from .records.station_options import StationOptions
 import alembic
 from alembic import command
 from alembic.config import Config
+from alembic.script import ScriptDirectory
 
-from sqlalchemy import create_engine, and_, or_, func
-from sqlalchemy.orm import sessionmaker, Session, joinedload
+from sqlalchemy import create_engine, event, or_, func, insert, select, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import sessionmaker, Session, joinedload, load_only
 
 from .models.user import User
 from .models.station import Station
@@ -33,6 +40,149 @@ from .models.track import Track
 from .models.genre import Genre
 from .models.track_genre import TrackGenre
 
+# How many tracks to keep in the subsonic_id lookup cache
+TRACK_CACHE_SIZE = 4096
+# How many stations to keep options cached for
+STATION_OPTIONS_CACHE_SIZE = 1024
+
+# Applied to every SQLite connection. WAL lets readers and the
+#  writer run concurrently, and with it synchronous=NORMAL only
+#  fsyncs at checkpoints.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "mmap_size": 1024 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # in KiB
+    "wal_autocheckpoint": 1000,
+    # wait for a busy writer instead of failing right away
+    "busy_timeout": 5000,  # in ms
+    "foreign_keys": "ON",
+    # keep ANALYZE (and optimize) quick on big tables
+    "analysis_limit": 1000,
+}
+
+
+# The journal mode is stored in the database file, so the read-only
+#  connections just pick up WAL from the writer (and can't set it).
+#  Foreign keys only matter for writes.
+SQLITE_READ_PRAGMAS = {
+    k: v for k, v in SQLITE_PRAGMAS.items() if k not in ("journal_mode", "foreign_keys")
+}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record, pragmas=SQLITE_PRAGMAS):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def _set_sqlite_read_pragmas(dbapi_connection, connection_record):
+    _set_sqlite_pragmas(dbapi_connection, connection_record, SQLITE_READ_PRAGMAS)
+
+
+def _optimize_sqlite_on_connect(dbapi_connection, connection_record):
+    # Connections are pooled and rarely close, so don't wait for that
+    #  to refresh the planner statistics. 0x10000 makes this look at
+    #  every table, not just ones this connection queried (SQLite
+    #  3.46+, older versions only look at those and do nothing here).
+    dbapi_connection.execute("PRAGMA optimize=0x10002")
+
+
+def _optimize_sqlite(dbapi_connection, connection_record):
+    # SQLite recommends this before closing a connection. It refreshes
+    #  the planner statistics for any tables this connection's queries
+    #  showed were out of date.
+    dbapi_connection.execute("PRAGMA optimize")
+
+
+def _has_history_stats(dbapi_connection) -> bool:
+    try:
+        return (
+            dbapi_connection.execute(
+                "SELECT 1 FROM sqlite_stat1 WHERE tbl = 'track_history'"
+            ).fetchone()
+            is not None
+        )
+    except sqlite3.OperationalError:
+        # Never analyzed, so there is no sqlite_stat1 table
+        return False
+
+
+def _serialize_array(arr) -> Optional[bytes]:
+    # Convert lists to numpy arrays and serialize as float32 binary data
+    if arr is None:
+        return None
+    return np.ascontiguousarray(arr, dtype=np.float32).tobytes()
+
+
+# The columns add_tracks_bulk fills in, the rest have defaults
+_TRACK_INSERT_COLUMNS = [
+    c.key
+    for c in Track.__table__.columns
+    if c.key not in ("id", "created_at", "updated_at")
+]
+
+
+# The statements behind the hot getters, built once. SQLAlchemy
+#  already caches the compiled SQL, but building a query (and its
+#  cache key) on every call still costs more than the lookup itself.
+_Q_USER = select(User).where(User.username == bindparam("username")).limit(1)
+_Q_STATIONS_FOR_USER = select(Station).where(Station.user_id == bindparam("user_id"))
+_Q_USER_STATION = (
+    select(Station)
+    .where(
+        Station.user_id == bindparam("user_id"), Station.id == bindparam("station_id")
+    )
+    .limit(1)
+)
+_Q_STATION = select(Station).where(Station.id == bindparam("station_id")).limit(1)
+_Q_TRACK_HISTORY = (
+    select(TrackHistory)
+    .options(joinedload(TrackHistory.track))  # Eagerly load the track
+    .where(TrackHistory.station_id == bindparam("station_id"))
+    .order_by(TrackHistory.updated_at.desc())
+)
+# The recent and thumbs downed histories are only used to filter
+#  and downrank tracks, so leave the feature columns (and their
+#  blobs) out of the eagerly loaded track
+_load_track_metadata = joinedload(TrackHistory.track).load_only(
+    Track.artist, Track.album, Track.title, Track.subsonic_id
+)
+_Q_TRACK_HISTORY_LIMIT = (
+    select(TrackHistory)
+    .options(_load_track_metadata)
+    .where(TrackHistory.station_id == bindparam("station_id"))
+    .order_by(TrackHistory.updated_at.desc())
+    .limit(bindparam("limit"))
+)
+_Q_THUMBS_DOWNED_HISTORY = (
+    select(TrackHistory)
+    .options(_load_track_metadata)
+    .where(
+        TrackHistory.station_id == bindparam("station_id"),
+        TrackHistory.is_thumbs_downed,
+    )
+    .order_by(TrackHistory.updated_at)
+)
+_Q_STORED_EMBEDDINGS = (
+    select(Track.embedding, Track.embedding_version, TrackHistory.rating)
+    .join(TrackHistory.track)
+    .where(TrackHistory.station_id == bindparam("station_id"))
+    .order_by(TrackHistory.updated_at.desc())
+)
+_Q_TRACK = select(Track).where(Track.subsonic_id == bindparam("subsonic_id")).limit(1)
+_Q_TRACK_ID = (
+    select(Track.id).where(Track.subsonic_id == bindparam("subsonic_id")).limit(1)
+)
+# The next song responses only need the metadata, not the blobs
+_Q_TRACKS = (
+    select(Track)
+    .options(load_only(Track.subsonic_id, Track.artist, Track.album, Track.title))
+    .where(Track.subsonic_id.in_(bindparam("subsonic_ids", expanding=True)))
+)
+
 
 class StationDB:
     """
@@ -45,7 +195,45 @@ class StationDB:
 
         # Set up SQLAlchemy engine and session
         self.engine = create_engine(f"sqlite:///{db_path}")
-        self.Session = sessionmaker(bind=self.engine)
+        event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        event.listen(self.engine, "connect", _optimize_sqlite_on_connect)
+        event.listen(self.engine, "close", _optimize_sqlite)
+        # Everything we return is used after its session closes, so
+        #  don't expire it on commit. Otherwise reading something like
+        #  the new id after a commit costs another SELECT.
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        # Connect once so the database is in WAL mode before any
+        #  read-only connection opens it. If there are no statistics
+        #  for the history yet (a new database only gets them once it
+        #  has some), gather them now, so the planner knows to use the
+        #  history indexes.
+        with self.engine.connect() as conn:
+            if not _has_history_stats(conn.connection.dbapi_connection):
+                conn.exec_driver_sql("ANALYZE")
+                conn.commit()
+
+        # A separate pool of read-only connections for the getters.
+        #  They can never take the write lock, so with WAL they don't
+        #  wait on (or hold up) the writer.
+        self.read_engine = create_engine(
+            f"sqlite:///file:{urllib.parse.quote(db_path)}?mode=ro&uri=true",
+            pool_size=os.cpu_count() or 5,
+        )
+        event.listen(self.read_engine, "connect", _set_sqlite_read_pragmas)
+        self.ReadSession = sessionmaker(bind=self.read_engine)
+
+        # LRU cache of subsonic_id -> track id. Tracks are looked up on
+        #  every rating/seed request, and their id never changes (the
+        #  metadata can, from another process, so that isn't cached).
+        #  The lock makes this safe to use from the server's db threads.
+        self._track_id_cache: OrderedDict[str, int] = OrderedDict()
+        self._track_id_cache_lock = threading.Lock()
+
+        # LRU cache of station_id -> StationOptions. The options are
+        #  read for every next song, but only change when the user
+        #  edits the station.
+        self._options_cache: OrderedDict[str, StationOptions] = OrderedDict()
+        self._options_cache_lock = threading.Lock()
 
     def _run_migrations(self):
         """Run any pending database migrations."""
@@ -66,8 +254,30 @@ class StationDB:
             "path_separator", os.pathsep
         )  # Fix for Alembic warning
         alembic_cfg.set_main_option("sqlalchemy.url", f"sqlite:///{self.db_path}")
+
+        # Most of the time we are already up to date. Checking that
+        #  ourselves is much cheaper than letting alembic set up its
+        #  migration environment just to find nothing to do.
+        head = ScriptDirectory.from_config(alembic_cfg).get_current_head()
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn:
+            try:
+                current = conn.execute(
+                    "SELECT version_num FROM alembic_version"
+                ).fetchall()
+            except sqlite3.OperationalError:
+                # No alembic_version table yet
+                current = []
+        if current == [(head,)]:
+            return
+
         command.upgrade(alembic_cfg, "head")
 
+        # Migrations can add indexes, so give the planner fresh
+        #  statistics for them
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn:
+            conn.execute("ANALYZE")
+            conn.commit()
+
     # ----------------------
     # User Management
     # ----------------------
@@ -82,11 +292,11 @@ class StationDB:
 
     def get_user(self, username: str) -> Optional[User]:
         """Get a user by username."""
-        with self.Session() as session:
-            return session.query(User).filter(User.username == username).first()
+        with self.ReadSession() as session:
+            return session.scalars(_Q_USER, {"username": username}).first()
 
     def get_all_users(self) -> List[User]:
-        with self.Session() as session:
+        with self.ReadSession() as session:
             return session.query(User).all()
 
     # ----------------------
@@ -101,14 +311,46 @@ class StationDB:
             session.commit()
             return station.id
 
+    def create_station_with_seed(
+        self,
+        user_id: int,
+        station_name: str,
+        options: StationOptions,
+        track: Track,
+        rating: int,
+    ) -> int:
+        """Create a new station with its options and seed track in a single transaction."""
+        with self.Session() as session:
+            station = Station(
+                user_id=user_id,
+                name=station_name,
+                replay_song_cooldown=options.replay_song_cooldown,
+                replay_artist_downrank=options.replay_artist_downrank,
+                ignore_live=options.ignore_live,
+            )
+            session.add(station)
+            session.flush()  # Get the station ID without committing
+
+            # A new station has no history, so there is nothing to update
+            session.add(
+                TrackHistory(
+                    track_id=track.id,
+                    station_id=station.id,
+                    is_thumbs_downed=False,
+                    rating=rating,
+                )
+            )
+            session.commit()
+            return station.id
+
     def get_stations_for_user(self, user_id: int) -> List[Station]:
         """Get all stations for a user."""
-        with self.Session() as session:
-            return session.query(Station).filter(Station.user_id == user_id).all()
+        with self.ReadSession() as session:
+            return session.scalars(_Q_STATIONS_FOR_USER, {"user_id": user_id}).all()
 
     def get_station_id(self, user_id: int, station_name: str) -> Optional[int]:
         """Get a station ID by user ID and station name."""
-        with self.Session() as session:
+        with self.ReadSession() as session:
             station = (
                 session.query(Station)
                 .filter(Station.user_id == user_id, Station.name == station_name)
@@ -118,25 +360,41 @@ class StationDB:
 
     def get_station(self, user_id: int, station_id: str) -> Optional[Station]:
         """Get a station by ID"""
-        with self.Session() as session:
-            return (
-                session.query(Station)
-                .filter(Station.user_id == user_id, Station.id == station_id)
-                .first()
-            )
+        with self.ReadSession() as session:
+            return session.scalars(
+                _Q_USER_STATION, {"user_id": user_id, "station_id": station_id}
+            ).first()
 
     def get_station_options(self, station_id: int) -> StationOptions:
-        """Get the options for a station"""
-        with self.Session() as session:
-            station = session.query(Station).filter(Station.id == station_id).first()
-            if station:
-                return StationOptions(
-                    replay_song_cooldown=station.replay_song_cooldown,
-                    replay_artist_downrank=station.replay_artist_downrank,
-                    ignore_live=station.ignore_live,
-                )
-            # Fallback to default options if station not found
-            return StationOptions()
+        """Get the options for a station
+
+        Options are cached, so treat them as read-only and go through
+        set_station_options to change them."""
+        key = str(station_id)
+        with self._options_cache_lock:
+            options = self._options_cache.get(key)
+            if options is not None:
+                self._options_cache.move_to_end(key)
+                return options
+
+        with self.ReadSession() as session:
+            station = session.scalars(_Q_STATION, {"station_id": station_id}).first()
+            if not station:
+                # Fallback to default options if station not found
+                return StationOptions()
+
+            options = StationOptions(
+                replay_song_cooldown=station.replay_song_cooldown,
+                replay_artist_downrank=station.replay_artist_downrank,
+                ignore_live=station.ignore_live,
+            )
+
+        with self._options_cache_lock:
+            self._options_cache[key] = options
+            if len(self._options_cache) > STATION_OPTIONS_CACHE_SIZE:
+                self._options_cache.popitem(last=False)
+
+        return options
 
     def set_station_options(
         self,
@@ -153,20 +411,30 @@ class StationDB:
                 station.ignore_live = ignore_live
                 session.commit()
 
-    def get_station_embedding(self, station_id: int) -> Optional[List[float]]:
-        """Get the current embedding for a station."""
-        with self.Session() as session:
-            station = session.query(Station).filter(Station.id == station_id).first()
+        with self._options_cache_lock:
+            self._options_cache.pop(str(station_id), None)
+
+    def get_station_embedding(self, station_id: int) -> Optional[np.ndarray]:
+        """Get the current embedding for a station.
+
+        This is a read-only view of the stored float32 data, copy it
+        before changing it."""
+        with self.ReadSession() as session:
+            station = session.scalars(_Q_STATION, {"station_id": station_id}).first()
             if station and station.current_embedding:
-                return station.current_embedding
+                return np.frombuffer(station.current_embedding, dtype=np.float32)
         return None
 
-    def set_station_embedding(self, station_id: int, embedding: List[float]) -> None:
+    def set_station_embedding(
+        self, station_id: int, embedding: List[float] | np.ndarray
+    ) -> None:
         """Set the current embedding for a station."""
         with self.Session() as session:
             station = session.query(Station).filter(Station.id == station_id).first()
             if station:
-                station.current_embedding = embedding
+                station.current_embedding = np.asarray(
+                    embedding, dtype=np.float32
+                ).tobytes()
                 session.commit()
 
     # ----------------------
@@ -181,135 +449,142 @@ class StationDB:
         rating: int = 0,
     ) -> int:
         """Add a track to the station's history. If it is recent, update the existing row"""
-        with self.Session() as session:
-            # Check if track already exists in history
-            track_history = (
-                session.query(TrackHistory)
-                .filter(
-                    TrackHistory.station_id == station_id,
-                    TrackHistory.track_id == track.id,
-                )
-                .first()
+        return self.add_track_id_to_or_update_history(
+            station_id, track.id, is_thumbs_downed, rating
+        )
+
+    def add_track_id_to_or_update_history(
+        self,
+        station_id: int,
+        track_id: int,
+        is_thumbs_downed: bool,
+        rating: int = 0,
+    ) -> int:
+        """Like add_track_to_or_update_history, but only needs the track's id"""
+        # Only a thumbs down and a non-zero rating overwrite what
+        #  is already there. The time comes from the database, the same
+        #  as it does for inserts and the model's onupdate.
+        updates = {"updated_at": func.now()}
+        if is_thumbs_downed:
+            updates["is_thumbs_downed"] = True
+        if rating != 0:
+            updates["rating"] = rating
+
+        stmt = (
+            sqlite_insert(TrackHistory)
+            .values(
+                track_id=track_id,
+                station_id=station_id,
+                is_thumbs_downed=is_thumbs_downed,
+                rating=rating,
+            )
+            .on_conflict_do_update(
+                index_elements=["station_id", "track_id"], set_=updates
             )
+            .returning(TrackHistory.id)
+        )
 
-            if track_history:
-                # Update existing record
-                track_history.updated_at = datetime.now()
-                # Only update thumbs_downed if it's being set to True
-                if is_thumbs_downed:
-                    track_history.is_thumbs_downed = is_thumbs_downed
-                # Update rating if provided
-                if rating != 0:
-                    track_history.rating = rating
-                session.commit()
-                return track_history.id
-            else:
-                # Create new record
-                track_history = TrackHistory(
-                    track_id=track.id,
-                    station_id=station_id,
-                    is_thumbs_downed=is_thumbs_downed,
-                    rating=rating,
-                )
-                session.add(track_history)
-                session.commit()
-                return track_history.id
+        with self.Session() as session:
+            track_history_id = session.execute(stmt).scalar_one()
+            session.commit()
+            return track_history_id
 
     def get_track_history(self, station_id: int, limit: int = 20) -> List[TrackHistory]:
-        """Get recent tracks played by a station."""
-        with self.Session() as session:
-            return (
-                session.query(TrackHistory)
-                .options(joinedload(TrackHistory.track))  # Eagerly load the track
-                .filter(TrackHistory.station_id == station_id)
-                .order_by(TrackHistory.updated_at.desc())
-                .limit(limit)
-                .all()
-            )
+        """Get recent tracks played by a station.
+
+        Only the artist, album, title and subsonic_id of the tracks are
+        loaded, use get_track_history_all for the full tracks."""
+        with self.ReadSession() as session:
+            return session.scalars(
+                _Q_TRACK_HISTORY_LIMIT, {"station_id": station_id, "limit": limit}
+            ).all()
 
     def get_track_history_all(self, station_id: int) -> List[TrackHistory]:
         """Get recent tracks played by a station."""
-        with self.Session() as session:
-            return (
-                session.query(TrackHistory)
-                .options(joinedload(TrackHistory.track))  # Eagerly load the track
-                .filter(TrackHistory.station_id == station_id)
-                .order_by(TrackHistory.updated_at.desc())
-                .all()
-            )
+        with self.ReadSession() as session:
+            return session.scalars(_Q_TRACK_HISTORY, {"station_id": station_id}).all()
 
     def get_thumbs_downed_history(self, station_id: int) -> List[TrackHistory]:
-        """Get all thumbs downed tracks by a station."""
-        with self.Session() as session:
-            return (
-                session.query(TrackHistory)
-                .options(joinedload(TrackHistory.track))  # Eagerly load the track
-                .filter(
-                    and_(
-                        TrackHistory.station_id == station_id,
-                        TrackHistory.is_thumbs_downed == True,
-                    )
-                )
-                .order_by(TrackHistory.updated_at)
-                .all()
-            )
+        """Get all thumbs downed tracks by a station.
 
-    def get_embedding_history(self, station_id: int) -> List[List[float]]:
+        Like get_track_history, only the track metadata is loaded."""
+        with self.ReadSession() as session:
+            return session.scalars(
+                _Q_THUMBS_DOWNED_HISTORY, {"station_id": station_id}
+            ).all()
+
+    def get_embedding_history(self, station_id: int) -> simulator.History:
         """Get embedding history for a station by fetching embeddings from tracks."""
+        with self.ReadSession() as session:
+            return self._get_embedding_history(session, station_id)
+
+    def _get_embedding_history(self, session, station_id: int) -> simulator.History:
+        # Every track normally has its embedding stored, so just read
+        #  those blobs and the ratings, and decode them all with a
+        #  single frombuffer.
+        rows = session.execute(_Q_STORED_EMBEDDINGS, {"station_id": station_id}).all()
+
+        if not all(
+            embedding is not None and version == feature_helper.VERSION
+            for embedding, version, _ in rows
+        ):
+            # Some still need to be computed from the track features.
+            #  Store just those, then end the read transaction so
+            #  reading everything back sees them.
+            self._store_missing_embeddings(station_id)
+            session.commit()
+            rows = session.execute(
+                _Q_STORED_EMBEDDINGS, {"station_id": station_id}
+            ).all()
+
+        # Skip anything without an embedding. store_embeddings always
+        #  writes all 148 dimensions, so the size doesn't need checking.
+        rows = [x for x in rows if x[1] == feature_helper.VERSION and x[0] is not None]
+        embeddings = np.frombuffer(
+            b"".join(x[0] for x in rows), dtype=feature_helper.STORED_DTYPE
+        ).reshape(len(rows), feature_helper.DIMENSIONS)
+        ranks = np.fromiter((x[2] for x in rows), dtype=np.float64, count=len(rows))
+
+        history = simulator.History(capacity=max(1, len(rows)))
+        return simulator.add_history_batch(history, embeddings, ranks)
+
+    def _store_missing_embeddings(self, station_id: int) -> None:
+        """Compute and save the embedding of every track in a station's
+        history that doesn't have an up-to-date one."""
         with self.Session() as session:
-            # Get track history with associated tracks for this station
-            track_histories = self.get_track_history_all(station_id)
-
-            # Extract just the embeddings from the tracks
-            history = simulator.make_history()
-            for history_item in track_histories:
-                # Get the embedding for this track
-                embedding = feature_helper.track_to_embeddings_default_normalization(
-                    history_item.track
+            tracks = session.scalars(
+                select(Track)
+                .join(TrackHistory.track)
+                .where(
+                    TrackHistory.station_id == station_id,
+                    # Tracks without extracted features can't have one
+                    Track.genre_embedding.is_not(None),
+                    Track.mfcc_mean.is_not(None),
+                    or_(
+                        Track.embedding.is_(None),
+                        Track.embedding_version.is_(None),
+                        Track.embedding_version != feature_helper.VERSION,
+                    ),
                 )
-                # Check that embedding has the right dimension (148)
-                if len(embedding) == 148:
-                    history = simulator.add_history(
-                        history, embedding, history_item.rating
-                    )
-
-            return history
+            ).all()
+            for track in tracks:
+                feature_helper.store_embeddings(track)
+            session.commit()
 
     # !mwd - TODO: This isn't currently used. Remove?
     def load_station_history(
         self, station_id: int
     ) -> Tuple[List[Any], List[TrackHistory], List[Dict[str, Any]]]:
         """Load embedding history, track history, and thumbs downed history for a station."""
-        tracks = self.get_track_history_all(station_id)
-
-        # Build history from embeddings
-        history = simulator.make_history()
-        for track_history in tracks:
-            # Get the embedding for this track
-            embedding = feature_helper.track_to_embeddings_default_normalization(
-                track_history.track
-            )
-            # Check that embedding has the right dimension (148)
-            if len(embedding) == 148:
-                history = simulator.add_history(
-                    history, embedding, track_history.rating
-                )
+        with self.ReadSession() as session:
+            history = self._get_embedding_history(session, station_id)
+            tracks = session.scalars(_Q_TRACK_HISTORY, {"station_id": station_id}).all()
 
-        # Build thumbs downed from track history
-        thumbs_downed = []
-        with self.Session() as session:
-            thumbs_downed = (
-                session.query(TrackHistory)
-                .options(joinedload(TrackHistory.track))  # Eagerly load the track
-                .filter(
-                    and_(
-                        TrackHistory.station_id == station_id,
-                        TrackHistory.is_thumbs_downed == True,
-                    )
-                )
-                .order_by(TrackHistory.created_at)
-                .all()
-            )
+        # The thumbs downed tracks are already in the history, so
+        #  pick them out instead of querying again
+        thumbs_downed = sorted(
+            (x for x in tracks if x.is_thumbs_downed), key=lambda x: x.created_at
+        )
 
         return history, tracks, thumbs_downed
 
@@ -362,17 +637,9 @@ class StationDB:
         spectral_character_contrast_mean: float,
         spectral_character_valley_std: float,
     ) -> Track:
-        # Convert lists to numpy arrays and serialize as binary data
-        def serialize_array(arr):
-            if arr is None:
-                return None
-            if isinstance(arr, list):
-                arr = np.array(arr)
-            return arr.tobytes()
-
-        genre_embedding_bytes = serialize_array(genre_embedding)
-        mfcc_covariance_bytes = serialize_array(mfcc_covariance)
-        mfcc_mean_bytes = serialize_array(mfcc_mean)
+        genre_embedding_bytes = _serialize_array(genre_embedding)
+        mfcc_covariance_bytes = _serialize_array(mfcc_covariance)
+        mfcc_mean_bytes = _serialize_array(mfcc_mean)
 
         with self.Session() as session:
             # Check if track already exists
@@ -428,47 +695,168 @@ class StationDB:
                 spectral_character_contrast_mean=spectral_character_contrast_mean,
                 spectral_character_valley_std=spectral_character_valley_std,
             )
+            # precompute the normalized embedding
+            if genre_embedding_bytes is not None and mfcc_mean_bytes is not None:
+                feature_helper.store_embeddings(track_record)
 
             session.add(track_record)
-            session.commit()
+            session.flush()  # Get the track ID without committing
 
             # Link genres using genre_list which looks like [{"label": "Heavy Metal", "score", 0.932}, ...]
             if genre_list:
-                for genre_item in genre_list:
-                    genre_label = genre_item["label"]
-                    genre_score = genre_item["score"]
-
-                    # Check if genre already exists
-                    genre = (
-                        session.query(Genre).filter(Genre.label == genre_label).first()
-                    )
-                    if not genre:
-                        # Create new genre if it doesn't exist
-                        genre = Genre(label=genre_label)
-                        session.add(genre)
-                        session.flush()  # Get the genre ID without committing
-
-                    # Create track-genre relationship with score
-                    track_genre = TrackGenre(
-                        track_id=track_record.id, genre_id=genre.id, score=genre_score
-                    )
-                    session.add(track_genre)
+                self._link_genres(session, {track_record.id: genre_list})
 
-                session.commit()
+            session.commit()
 
             # Merge the track back into the session
             track_record = session.merge(track_record)
 
             return track_record
 
+    def add_tracks_bulk(
+        self, tracks: Iterable[Dict[str, Any]], batch_size: int = 1000
+    ) -> int:
+        """Add many tracks at once.
+
+        Each item has the same keyword arguments as add_track. Tracks
+        are written batch_size at a time, one transaction per batch,
+        and any whose subsonic_id is already in the database are
+        skipped. Returns how many tracks were added."""
+        tracks = iter(tracks)
+        added = 0
+        while batch := list(itertools.islice(tracks, batch_size)):
+            added += self._add_tracks_batch(batch)
+        return added
+
+    def _add_tracks_batch(self, batch: List[Dict[str, Any]]) -> int:
+        with self.Session() as session:
+            existing = set(
+                session.scalars(
+                    select(Track.subsonic_id).where(
+                        Track.subsonic_id.in_([x["subsonic_id"] for x in batch])
+                    )
+                )
+            )
+
+            rows = {}
+            genre_lists = {}
+            for item in batch:
+                subsonic_id = item["subsonic_id"]
+                if subsonic_id in existing or subsonic_id in rows:
+                    continue
+
+                columns = dict(item)
+                genre_lists[subsonic_id] = columns.pop("genre_list", None)
+                for k in ("genre_embedding", "mfcc_covariance", "mfcc_mean"):
+                    columns[k] = _serialize_array(columns.get(k))
+
+                # A throwaway track, just to precompute the normalized
+                #  embedding the same way add_track does
+                track = Track(**columns)
+                if track.genre_embedding is not None and track.mfcc_mean is not None:
+                    feature_helper.store_embeddings(track)
+                rows[subsonic_id] = {
+                    k: getattr(track, k) for k in _TRACK_INSERT_COLUMNS
+                }
+
+            if rows:
+                session.execute(insert(Track), list(rows.values()))
+                track_ids = dict(
+                    session.execute(
+                        select(Track.subsonic_id, Track.id).where(
+                            Track.subsonic_id.in_(list(rows))
+                        )
+                    ).all()
+                )
+                genre_lists = {
+                    track_ids[subsonic_id]: genre_list
+                    for subsonic_id, genre_list in genre_lists.items()
+                    if genre_list
+                }
+                if genre_lists:
+                    self._link_genres(session, genre_lists)
+
+            session.commit()
+            return len(rows)
+
+    def _link_genres(
+        self, session: Session, genre_lists: Dict[int, List[Dict[str, Any]]]
+    ) -> None:
+        """Add the genres of some tracks, given as track_id -> genre_list,
+        creating any genres we haven't seen before. This is a fixed
+        handful of statements no matter how many genres there are."""
+        labels = {x["label"] for genre_list in genre_lists.values() for x in genre_list}
+
+        def genre_ids():
+            return dict(
+                session.execute(
+                    select(Genre.label, Genre.id).where(Genre.label.in_(labels))
+                ).all()
+            )
+
+        ids = genre_ids()
+        missing = [{"label": x} for x in labels if x not in ids]
+        if missing:
+            session.execute(
+                sqlite_insert(Genre).values(missing).on_conflict_do_nothing()
+            )
+            ids = genre_ids()
+
+        session.execute(
+            insert(TrackGenre),
+            [
+                {
+                    "track_id": track_id,
+                    "genre_id": ids[x["label"]],
+                    "score": x["score"],
+                }
+                for track_id, genre_list in genre_lists.items()
+                for x in genre_list
+            ],
+        )
+
     def update_track(self, track: Track) -> Track:
         with self.Session() as session:
             session.merge(track)
             session.commit()
 
-            return track
+        return track
 
     def get_track_by_subsonic_id(self, subsonic_id: str) -> Track | None:
         """Get a track based on subsonic id"""
-        with self.Session() as session:
-            return session.query(Track).filter(Track.subsonic_id == subsonic_id).first()
+        with self.ReadSession() as session:
+            return session.scalars(_Q_TRACK, {"subsonic_id": subsonic_id}).first()
+
+    def get_track_id_by_subsonic_id(self, subsonic_id: str) -> Optional[int]:
+        """Get the id of a track based on subsonic id.
+
+        These are cached, so recording plays and ratings doesn't need
+        to load the track."""
+        with self._track_id_cache_lock:
+            track_id = self._track_id_cache.get(subsonic_id)
+            if track_id is not None:
+                self._track_id_cache.move_to_end(subsonic_id)
+                return track_id
+
+        with self.ReadSession() as session:
+            track_id = session.scalars(
+                _Q_TRACK_ID, {"subsonic_id": subsonic_id}
+            ).first()
+
+        if track_id is not None:
+            with self._track_id_cache_lock:
+                self._track_id_cache[subsonic_id] = track_id
+                if len(self._track_id_cache) > TRACK_CACHE_SIZE:
+                    self._track_id_cache.popitem(last=False)
+
+        return track_id
+
+    def get_tracks_by_subsonic_ids(self, subsonic_ids: List[str]) -> Dict[str, Track]:
+        """Get several tracks by subsonic id with a single query.
+
+        Returns a dict of subsonic_id -> Track, ids that aren't found
+        are left out. Only the subsonic_id, artist, album and title of
+        the tracks are loaded."""
+        with self.ReadSession() as session:
+            found = session.scalars(_Q_TRACKS, {"subsonic_ids": subsonic_ids}).all()
+        return {x.subsonic_id: x for x in found}
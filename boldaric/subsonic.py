@@ -8,6 +8,8 @@
 # This provides a RESTful API for creating stations, getting next
 # tracks for a stations, rating songs, seeding songs, and so on.
 
+import functools
+
 import libsonic
 
 
@@ -18,6 +20,9 @@ def make_from_parameters(url: str, username: str, password: str, port: int = 443
     return c
 
 
+# The pre-authed links only depend on the connection and the
+#  subsonic_id, so build each one once and reuse it.
+@functools.lru_cache(maxsize=8192)
 def make_stream_link(conn, subsonic_id: str):
     # !mwd - this is a bit hacky, but we can use some internals
     #  to generate a pre-authed URL to directly stream
@@ -28,6 +33,7 @@ def make_stream_link(conn, subsonic_id: str):
     return full_url
 
 
+@functools.lru_cache(maxsize=8192)
 def make_album_art_link(conn, subsonic_id: str):
     # !mwd - this is a bit hacky, but we can use some internals
     #  to generate a pre-authed URL to directly stream
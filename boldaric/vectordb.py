@@ -11,6 +11,7 @@
 #  embeddings, along with lookup, and similarity searches.
 
 import json
+from collections.abc import Collection
 
 import chromadb
 
@@ -70,7 +71,7 @@ class VectorDB:
         # A future plan, is to either:
         #  - Store un-normalized embeddings in the db, then do scaling when we query
         #  - Or, have multiple collections, each with a category of embedding (default, mood, energy, genre similarity, ...)
-        embedding = feature_helper.track_to_embeddings_default_normalization(track)
+        embedding = feature_helper.get_track_embeddings(track).tolist()
 
         metadata = TrackMetadata(
             subsonic_id=subsonic_id,
@@ -133,17 +134,37 @@ class VectorDB:
         self,
         embedding: list[float],
         n_results: int = 5,
-        ignore_songs: list[tuple[str, str]] = [],
+        ignore_songs: Collection[tuple[str, str]] = frozenset(),
+        ignore_ids: Collection[str] = (),
+        require_subsonic_id: bool = False,
     ) -> list[dict]:
+        # Anything we know the subsonic_id of is filtered out by
+        #  chroma, so it never comes back in the results. Every track
+        #  is stored with a subsonic_id (see TrackMetadata), so tracks
+        #  without one have it set to "".
+        excluded_ids = list(ignore_ids)
+        if require_subsonic_id:
+            excluded_ids.append("")
+
+        where = None
+        if len(excluded_ids) > 0:
+            where = {"subsonic_id": {"$nin": excluded_ids}}
+
         # query for similar items. We are going to do some filtering,
         #  so we query for 3x more results, but only return the top
         #  n_results
         results = self.collection.query(
             query_embeddings=[embedding],
             n_results=n_results * 3,
+            where=where,
             include=["embeddings", "metadatas", "distances"],
         )
 
+        # The same song can live on more than one album, so also
+        #  filter by (artist, title). Use a set for the lookups.
+        if not isinstance(ignore_songs, (set, frozenset)):
+            ignore_songs = set(ignore_songs)
+
         # Process the results
         final_results = []
 
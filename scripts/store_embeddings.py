@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+# This script runs through all the tracks in the sqlitedb
+# and stores the normalized embedding on any track that
+#  doesn't have an up-to-date one yet. The server fills these
+#  in lazily, this just does it all up front.
+
+import argparse
+import os
+
+from sqlalchemy import and_, func, or_
+import rich.progress
+
+import boldaric
+from boldaric import feature_helper
+from boldaric.models.track import Track
+
+BATCH_SIZE = 1000
+
+
+def go(stationdb):
+    with rich.progress.Progress(
+        rich.progress.SpinnerColumn(),
+        rich.progress.TextColumn("[progress.description]{task.description:.20s}"),
+        rich.progress.BarColumn(),
+        rich.progress.MofNCompleteColumn(),
+        rich.progress.TimeRemainingColumn(),
+        rich.progress.TimeElapsedColumn(),
+        expand=True,
+    ) as progress:
+        # Tracks without extracted features can't have an embedding
+        missing = and_(
+            Track.genre_embedding.is_not(None),
+            Track.mfcc_mean.is_not(None),
+            or_(
+                Track.embedding.is_(None),
+                Track.embedding_version.is_(None),
+                Track.embedding_version != feature_helper.VERSION,
+            ),
+        )
+        with stationdb.Session() as session:
+            total_count = session.query(func.count(Track.id)).filter(missing).scalar()
+            task_id = progress.add_task("Embedding", total=total_count)
+
+            # Storing an embedding takes the track out of the filter,
+            #  so keep taking the first batch until there are none left
+            while (
+                tracks := session.query(Track).filter(missing).limit(BATCH_SIZE).all()
+            ):
+                for track in tracks:
+                    feature_helper.store_embeddings(track)
+                session.commit()
+                progress.update(task_id, advance=len(tracks))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store track embeddings")
+    parser.add_argument(
+        "-d",
+        "--db-path",
+        default="./db",
+        dest="db_path",
+        help="Path to the station database",
+    )
+    args = parser.parse_args()
+
+    db_name = os.path.join(args.db_path, "stations.db")
+    stationdb = boldaric.StationDB(db_name)
+
+    go(stationdb)
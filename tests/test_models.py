@@ -145,15 +145,24 @@ def test_station_track_history_relationship(db_session):
         title="Test Title",
         subsonic_id="song123",
     )
-    db_session.add(track)
+    other_track = Track(
+        artist="Other Artist",
+        album="Other Album",
+        title="Other Title",
+        subsonic_id="song456",
+    )
+    db_session.add_all([track, other_track])
     db_session.commit()
 
-    # Create track histories
+    # Create track histories, a track is only in a station's history once
     track1 = TrackHistory(
         station_id=station.id, track_id=track.id, is_thumbs_downed=False, rating=3
     )
     track2 = TrackHistory(
-        station_id=station.id, track_id=track.id, is_thumbs_downed=False, rating=4
+        station_id=station.id,
+        track_id=other_track.id,
+        is_thumbs_downed=False,
+        rating=4,
     )
     db_session.add_all([track1, track2])
     db_session.commit()
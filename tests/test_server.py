@@ -3,6 +3,8 @@ import asyncio
 import json
 import tempfile
 import os
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 from unittest.mock import Mock, patch
 from aiohttp import web
 from aiohttp.test_utils import AioHTTPTestCase
@@ -13,6 +15,8 @@ from boldaric.server import (
     get_stations,
     make_station,
     get_next_song_for_station,
+    get_next_songs,
+    pick_tracks,
     get_station_info,
     update_station_info,
     add_seed,
@@ -22,12 +26,21 @@ from boldaric.server import (
     search,
     CreateStationParams,
     UpdateStationParams,
+    build_user_tokens,
+    make_token,
 )
+from boldaric.records.station_options import StationOptions
 from boldaric.stationdb import StationDB
 from boldaric.vectordb import VectorDB
 from boldaric.models.track import Track
 import boldaric.subsonic
 import boldaric.feature_helper
+import boldaric.simulator
+
+
+def one_point_history():
+    history = boldaric.simulator.make_history()
+    return boldaric.simulator.add_history(history, [0.1] * 148, 1)
 
 
 class TestServer(AioHTTPTestCase):
@@ -50,6 +63,8 @@ class TestServer(AioHTTPTestCase):
 
     def tearDown(self):
         """Clean up test resources."""
+        self.db_executor.shutdown()
+        self.cpu_executor.shutdown()
         self.temp_dir.cleanup()
         super().tearDown()
 
@@ -107,6 +122,7 @@ class TestServer(AioHTTPTestCase):
         # Application state
         app["salt"] = b"test_salt_1234567890"
         app["station_db"] = self.station_db
+        app["user_tokens"] = build_user_tokens(self.station_db, app["salt"])
 
         # Create a mock VectorDB
         self.mock_vec_db = Mock(spec=VectorDB)
@@ -116,10 +132,12 @@ class TestServer(AioHTTPTestCase):
         self.mock_sub_conn = Mock()
         app["sub_conn"] = self.mock_sub_conn
 
-        # Create a mock pool
-        self.mock_pool = Mock()
-        self.mock_pool._processes = 4  # Set the _processes attribute to an integer
-        app["pool"] = self.mock_pool
+        self.db_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="db")
+        app["db_executor"] = self.db_executor
+        self.cpu_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cpu")
+        app["cpu_executor"] = self.cpu_executor
+        app["stations_versions"] = {}
+        app["stations_epoch"] = "test"
 
         # Add routes for testing
         app.router.add_post("/api/auth", auth)
@@ -143,11 +161,9 @@ class TestServer(AioHTTPTestCase):
 
     def _create_auth_header(self, username="testuser"):
         """Create an authorization header for testing."""
-        import hashlib
-
         salt = b"test_salt_1234567890"
-        token = hashlib.sha256(salt + username.encode("utf-8")).hexdigest()
-        return {"Authorization": f"Bearer {token}"}
+        token = make_token(salt, username)
+        return {"Authorization": f"Bearer {token.hex()}"}
 
     async def test_auth_success(self):
         """Test successful authentication."""
@@ -165,6 +181,38 @@ class TestServer(AioHTTPTestCase):
         assert data["id"] == self.test_user_id
         assert data["username"] == "testuser"
 
+    async def test_auth_user_created_after_startup(self):
+        """Test that users created after startup can log in and use their token."""
+        user_id = self.station_db.create_user("newuser")
+
+        resp = await self.client.request(
+            "POST",
+            "/api/auth",
+            data=json.dumps({"login": "newuser"}),
+            headers={"Content-Type": "application/json"},
+        )
+
+        assert resp.status == 200
+        data = await resp.json()
+        assert data["id"] == user_id
+
+        resp = await self.client.request(
+            "GET",
+            "/api/stations",
+            headers={"Authorization": f"Bearer {data['token']}"},
+        )
+        assert resp.status == 200
+
+    async def test_malformed_token(self):
+        """Test that a token that isn't hex is rejected."""
+        resp = await self.client.request(
+            "GET",
+            "/api/stations",
+            headers={"Authorization": "Bearer not-a-hex-token"},
+        )
+
+        assert resp.status == 401
+
     async def test_auth_failure(self):
         """Test authentication failure."""
         # Make request
@@ -201,6 +249,36 @@ class TestServer(AioHTTPTestCase):
         assert "Station 1" in station_names
         assert "Station 2" in station_names
 
+    async def test_get_stations_etag(self):
+        """Test that an unchanged station list is answered with a 304."""
+        station_id = self.station_db.create_station(self.test_user_id, "Station 1")
+
+        resp = await self.client.request(
+            "GET", "/api/stations", headers=self._create_auth_header()
+        )
+        assert resp.status == 200
+        etag = resp.headers["ETag"]
+
+        headers = {**self._create_auth_header(), "If-None-Match": etag}
+        resp = await self.client.request("GET", "/api/stations", headers=headers)
+        assert resp.status == 304
+        assert resp.headers["ETag"] == etag
+
+        # Changing a station gives the list a new tag
+        resp = await self.client.request(
+            "PUT",
+            f"/api/station/{station_id}/info",
+            data=json.dumps({"replay_song_cooldown": 10}),
+            headers={**self._create_auth_header(), "Content-Type": "application/json"},
+        )
+        assert resp.status == 200
+
+        resp = await self.client.request("GET", "/api/stations", headers=headers)
+        assert resp.status == 200
+        assert resp.headers["ETag"] != etag
+        data = await resp.json()
+        assert data[0]["replay_song_cooldown"] == 10
+
     async def test_make_station_success(self):
         """Test creating a station successfully."""
         # Mock the vector database response
@@ -556,11 +634,6 @@ class TestServer(AioHTTPTestCase):
                                 "boldaric.feature_helper.track_to_embeddings",
                                 return_value={},
                             ):
-                                # Mock multiprocessing pool methods
-                                self.mock_pool.apply_async.return_value.get.return_value = (
-                                    mock_tracks
-                                )
-
                                 # Make request
                                 resp = await self.client.request(
                                     "GET",
@@ -617,6 +690,20 @@ class TestServer(AioHTTPTestCase):
         assert params.replay_artist_downrank == 0.95
         assert params.ignore_live is True
 
+    def test_station_params_ignore_unknown_keys(self):
+        """Test that unknown posted keys are dropped during validation."""
+        params = CreateStationParams.model_validate(
+            {"station_name": "Test Station", "song_id": "song123", "bogus": 1}
+        )
+        assert params.station_name == "Test Station"
+        assert not hasattr(params, "bogus")
+
+        params = UpdateStationParams.model_validate(
+            {"replay_song_cooldown": 10, "station_name": "ignored"}
+        )
+        assert params.replay_song_cooldown == 10
+        assert not hasattr(params, "station_name")
+
     def test_update_station_params_validation(self):
         """Test UpdateStationParams validation."""
         # Test valid parameters
@@ -626,3 +713,105 @@ class TestServer(AioHTTPTestCase):
         assert params.replay_song_cooldown == 50
         assert params.replay_artist_downrank == 0.95
         assert params.ignore_live is True
+
+    def test_get_next_songs_downranks_recent_artists(self):
+        """Test that recent artists are downranked and results re-sorted."""
+
+        def candidate(subsonic_id, artist, similarity):
+            return {
+                "metadata": {
+                    "subsonic_id": subsonic_id,
+                    "artist": artist,
+                    "title": f"Title {subsonic_id}",
+                },
+                "features": {},
+                "similarity": similarity,
+            }
+
+        vec_db = Mock()
+        vec_db.query_similar.return_value = [
+            candidate("song1", "Artist 1", 0.9),
+            candidate("song2", "Artist 2", 0.8),
+            candidate("song3", "Artist 3", 0.7),
+        ]
+        played = [
+            SimpleNamespace(
+                track=SimpleNamespace(
+                    artist="Artist 1", title="Other", subsonic_id="played1"
+                )
+            )
+        ]
+        options = StationOptions(
+            replay_song_cooldown=50, replay_artist_downrank=0.5, ignore_live=False
+        )
+
+        with patch("boldaric.simulator.attract", return_value=[0.1] * 148):
+            tracks = get_next_songs(
+                vec_db, None, options, one_point_history(), played, []
+            )
+
+        assert [t["metadata"]["subsonic_id"] for t in tracks] == [
+            "song2",
+            "song3",
+            "song1",
+        ]
+        assert tracks[2]["similarity"] == pytest.approx(0.45)
+        assert tracks[0]["similarity"] == pytest.approx(0.8)
+
+        _, kwargs = vec_db.query_similar.call_args
+        assert kwargs["ignore_songs"] == {("Artist 1", "Other")}
+        assert kwargs["ignore_ids"] == {"played1"}
+        assert kwargs["require_subsonic_id"] is True
+
+    def test_get_next_songs_cooldown_uses_most_recent(self):
+        """Test that the cooldown ignores the newest played tracks."""
+
+        def played_track(subsonic_id):
+            return SimpleNamespace(
+                track=SimpleNamespace(
+                    artist=f"Artist {subsonic_id}",
+                    title=f"Title {subsonic_id}",
+                    subsonic_id=subsonic_id,
+                )
+            )
+
+        vec_db = Mock()
+        vec_db.query_similar.return_value = []
+        # most recent first
+        played = [played_track("newest"), played_track("older")]
+        options = StationOptions(
+            replay_song_cooldown=1, replay_artist_downrank=0.5, ignore_live=False
+        )
+
+        with patch("boldaric.simulator.attract", return_value=[0.1] * 148):
+            get_next_songs(vec_db, None, options, one_point_history(), played, [])
+
+        _, kwargs = vec_db.query_similar.call_args
+        assert kwargs["ignore_ids"] == {"newest"}
+
+    def test_get_next_songs_empty_history(self):
+        """Test that a station without history doesn't query for songs."""
+        vec_db = Mock()
+        options = StationOptions(
+            replay_song_cooldown=50, replay_artist_downrank=0.5, ignore_live=False
+        )
+
+        history = boldaric.simulator.make_history()
+        assert get_next_songs(vec_db, None, options, history, [], []) == []
+        vec_db.query_similar.assert_not_called()
+
+    def test_pick_tracks(self):
+        """Test picking distinct tracks weighted by similarity."""
+        tracks = [
+            {"id": i, "similarity": s} for i, s in enumerate([0.9, 0.0, 0.5, -0.2, 0.7])
+        ]
+
+        for _ in range(20):
+            picks = pick_tracks(tracks, 3)
+            assert sorted(t["id"] for t in picks) == [0, 2, 4]
+
+        # there are only two tracks that can be picked
+        assert len(pick_tracks(tracks[:3], 3)) == 2
+        assert pick_tracks([], 3) == []
+        # with nothing to weight by, pick uniformly
+        assert len(pick_tracks([{"id": 0, "similarity": 0.0}], 3)) == 1
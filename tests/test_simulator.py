@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from boldaric import simulator
+
+
+def test_add_history_batch_matches_add_history():
+    """Test that the batched history holds the same points as add_history."""
+    rng = np.random.default_rng(0)
+    embeddings = [(rng.random(148).astype(np.float32), r) for r in (3, 8, -3, 5)]
+
+    # start small so the buffers have to grow
+    history = simulator.make_history(capacity=1)
+    for embedding, rank in embeddings:
+        history = simulator.add_history(history, embedding, rank)
+
+    batch = simulator.add_history_batch(
+        simulator.make_history(capacity=4),
+        np.array([e for e, _ in embeddings]),
+        [r for _, r in embeddings],
+    )
+
+    assert len(history) == len(batch) == 4
+    expected_values = np.array([e for e, _ in embeddings], dtype=np.float64).T
+    expected_ranks = np.broadcast_to([3, 8, -3, 5], (148, 4))
+    for h in (history, batch):
+        np.testing.assert_array_equal(h.values[:, : len(h)], expected_values)
+        np.testing.assert_array_equal(h.attractions[:, : len(h)], expected_ranks)
+
+
+def test_add_history_batch_grows():
+    """Test that a batch can be added to a history that is too small."""
+    rng = np.random.default_rng(3)
+    history = simulator.make_history(capacity=1)
+    simulator.add_history(history, rng.random(148), 3)
+
+    embeddings = rng.random((5, 148))
+    simulator.add_history_batch(history, embeddings, [8, -3, 5, 3, 3])
+
+    assert len(history) == 6
+    np.testing.assert_array_equal(history.values[:, 1:6], embeddings.T)
+    np.testing.assert_array_equal(history.attractions[0, :6], [3, 8, -3, 5, 3, 3])
+
+
+def test_attract_matches_per_dimension_simulation():
+    """Test that the batched simulation matches running each dimension alone."""
+    rng = np.random.default_rng(1)
+    history = simulator.make_history(capacity=8)
+    for r in (3, 8, -3, 5, 3):
+        simulator.add_history(history, rng.random(148).astype(np.float32), r)
+
+    n = len(history)
+    np.random.seed(0)
+    expected = [
+        simulator.run_simulation(
+            np.stack([history.values[i, :n], history.attractions[i, :n]], axis=1)
+        )
+        for i in range(148)
+    ]
+
+    np.random.seed(0)
+    result = simulator.attract(history)
+
+    assert len(result) == 148
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+
+
+def test_attract_empty_history():
+    """Test that an empty history gives NaN instead of garbage."""
+    result = simulator.attract(simulator.make_history())
+
+    assert len(result) == 148
+    assert np.isnan(result).all()
+
+
+def _reference_simulation(values, attractions, offset):
+    # The plain numpy version of the particle simulation
+    particle_position = np.mean(values) + offset
+    velocity = 0.0
+    prev_position = particle_position
+    for _ in range(100):
+        distance = values - particle_position
+        force = np.sum(attractions * np.exp(-(distance**2) / 0.005) * np.sign(distance))
+        velocity = velocity * 0.99 + force * 0.001
+        particle_position += velocity * 0.001
+        if abs(particle_position - prev_position) < 1e-6 and abs(velocity) < 1e-6:
+            break
+        prev_position = particle_position
+    return particle_position
+
+
+def test_simulate_dimension_matches_reference():
+    """Test that the compiled simulation matches the numpy version."""
+    rng = np.random.default_rng(2)
+    for n in (1, 7, 50):
+        values = rng.random(n)
+        attractions = rng.choice([3.0, 5.0, 8.0, -3.0], n)
+        for offset in (-0.01, 0.0, 0.005):
+            assert simulator._simulate_dimension(
+                values, attractions, offset
+            ) == pytest.approx(
+                _reference_simulation(values, attractions, offset), abs=1e-12
+            )
+
+
+def test_warm_up():
+    """Test that the simulator works after warming it up."""
+    simulator.warm_up()
+
+    history = simulator.make_history(capacity=1)
+    simulator.add_history(history, np.full(148, 0.5), 1)
+    result = simulator.attract(history)
+    assert len(result) == 148
+    assert np.all(np.isfinite(result))
@@ -1,6 +1,8 @@
+import inspect
 import os
 import tempfile
 import pytest
+import numpy as np
 from datetime import datetime, timedelta
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -20,8 +22,9 @@ def station_db():
         yield db
 
 
-def create_track(station_db, artist, album, title, subsonic_id):
-    station_db.add_track(
+def track_fields(artist, album, title, subsonic_id, genre_list=()):
+    """The add_track arguments for a test track, as a dict"""
+    args = (
         artist,
         album,
         title,
@@ -33,7 +36,7 @@ def create_track(station_db, artist, album, title, subsonic_id):
         "",
         "album",
         "official",
-        [],
+        list(genre_list),
         [0.1] * 128,  # genre
         [0.2] * 13,
         [0.21] * 13,
@@ -66,6 +69,13 @@ def create_track(station_db, artist, album, title, subsonic_id):
         0.34,
         0.53,  # spectral
     )
+    bound = inspect.signature(StationDB.add_track).bind(None, *args)
+    del bound.arguments["self"]
+    return bound.arguments
+
+
+def create_track(station_db, artist, album, title, subsonic_id, genre_list=()):
+    station_db.add_track(**track_fields(artist, album, title, subsonic_id, genre_list))
     return station_db.get_track_by_subsonic_id(subsonic_id)
 
 
@@ -121,6 +131,26 @@ def test_create_station(station_db):
     assert station_id > 0
 
 
+def test_create_station_with_seed(station_db):
+    """Test creating a station with its options and seed track."""
+    user_id = station_db.create_user("testuser")
+    track = create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+
+    options = StationOptions(
+        replay_song_cooldown=30, replay_artist_downrank=0.9, ignore_live=True
+    )
+    station_id = station_db.create_station_with_seed(
+        user_id, "Test Station", options, track, 8
+    )
+
+    assert station_db.get_station_options(station_id) == options
+    history = station_db.get_track_history(station_id)
+    assert len(history) == 1
+    assert history[0].track.subsonic_id == "song1"
+    assert history[0].rating == 8
+    assert history[0].is_thumbs_downed == False
+
+
 def test_get_stations_for_user(station_db):
     """Test getting all stations for a user."""
     # Create a user
@@ -218,6 +248,25 @@ def test_set_station_options(station_db):
     assert options.ignore_live == True
 
 
+def test_station_options_cache(station_db):
+    """Test that station options are cached and invalidated when set."""
+    user_id = station_db.create_user("testuser")
+    station_id = station_db.create_station(user_id, "Test Station")
+
+    options = station_db.get_station_options(station_id)
+    # The server passes the id from the url as a string
+    assert station_db.get_station_options(str(station_id)) is options
+
+    station_db.set_station_options(str(station_id), 10, 0.9, True)
+    options = station_db.get_station_options(station_id)
+    assert options.replay_song_cooldown == 10
+    assert options.ignore_live == True
+
+    # Missing stations get the defaults, which aren't cached
+    assert station_db.get_station_options(9999) == StationOptions()
+    assert "9999" not in station_db._options_cache
+
+
 def test_station_embedding(station_db):
     """Test setting and getting station embedding."""
     # Create a user and station
@@ -235,7 +284,14 @@ def test_station_embedding(station_db):
     # Get the embedding
     embedding = station_db.get_station_embedding(station_id)
     assert embedding is not None
-    assert embedding == test_embedding
+    # Stored as float32
+    assert embedding == pytest.approx(test_embedding, rel=1e-6)
+    assert embedding.dtype == np.float32
+
+    # Arrays work as well as lists
+    station_db.set_station_embedding(station_id, np.array(test_embedding[::-1]))
+    embedding = station_db.get_station_embedding(station_id)
+    assert embedding == pytest.approx(test_embedding[::-1], rel=1e-6)
 
 
 def test_add_track_to_history(station_db):
@@ -298,6 +354,32 @@ def test_update_track_in_history(station_db):
     assert track_history_id1 == track_history_id2
 
 
+def test_update_track_in_history_keeps_rating_and_thumbs_down(station_db):
+    """Test that a zero rating or no thumbs down doesn't overwrite the history."""
+    from boldaric.models.track_history import TrackHistory
+
+    user_id = station_db.create_user("testuser")
+    station_id = station_db.create_station(user_id, "Test Station")
+    track = create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+
+    history_id = station_db.add_track_to_or_update_history(station_id, track, True, -3)
+    assert station_db.add_track_to_or_update_history(station_id, track, False) == (
+        history_id
+    )
+
+    with station_db.Session() as session:
+        history = session.get(TrackHistory, history_id)
+        assert history.is_thumbs_downed is True
+        assert history.rating == -3
+
+    station_db.add_track_to_or_update_history(station_id, track, False, 5)
+    with station_db.Session() as session:
+        history = session.get(TrackHistory, history_id)
+        assert history.is_thumbs_downed is True
+        assert history.rating == 5
+        assert session.query(TrackHistory).count() == 1
+
+
 def test_get_track_history(station_db):
     """Test getting track history."""
     # Create a user and station
@@ -361,6 +443,9 @@ def test_get_track_history(station_db):
     # Should be ordered by updated_at descending (most recent first)
     assert history[0].track.subsonic_id == "song3"
     assert history[1].track.subsonic_id == "song2"
+    assert history[0].track.artist == "Artist 3"
+    # The feature columns aren't loaded
+    assert "genre_embedding" not in history[0].track.__dict__
 
 
 def test_get_thumbs_downed_history(station_db):
@@ -426,3 +511,301 @@ def test_load_station_history(station_db):
     assert len(thumbs_downed) == 1
     assert thumbs_downed[0].track.artist == "Artist 2"
     assert thumbs_downed[0].track.title == "Title 2"
+
+
+def test_add_track_stores_embedding(station_db):
+    """Test that adding a track precomputes its normalized embedding."""
+    from boldaric import feature_helper
+
+    track = create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+
+    assert feature_helper.has_stored_embeddings(track)
+    assert feature_helper.get_track_embeddings(track) == pytest.approx(
+        feature_helper.track_to_embeddings_default_normalization(track), abs=1e-3
+    )
+    assert len(track.embedding) == feature_helper.DIMENSIONS * 2
+
+
+def test_get_embedding_history_stores_missing_embeddings(station_db):
+    """Test that embeddings missing from old tracks are computed and saved."""
+    from boldaric import feature_helper
+
+    user_id = station_db.create_user("testuser")
+    station_id = station_db.create_station(user_id, "Test Station")
+    track = create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+
+    # Simulate a track from before embeddings were stored
+    with station_db.Session() as session:
+        t = session.query(Track).filter(Track.id == track.id).one()
+        t.embedding = None
+        t.embedding_version = None
+        session.commit()
+
+    station_db.add_track_to_or_update_history(station_id, track, False, 5)
+    history = station_db.get_embedding_history(station_id)
+    assert len(history) == 1
+
+    track = station_db.get_track_by_subsonic_id("song1")
+    assert feature_helper.has_stored_embeddings(track)
+
+
+def test_load_station_history_stores_missing_embeddings(station_db):
+    """Test that embeddings stored while loading history are read back."""
+    user_id = station_db.create_user("testuser")
+    station_id = station_db.create_station(user_id, "Test Station")
+    track = create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+
+    with station_db.Session() as session:
+        t = session.query(Track).filter(Track.id == track.id).one()
+        t.embedding = None
+        t.embedding_version = None
+        session.commit()
+
+    station_db.add_track_to_or_update_history(station_id, track, True, -3)
+    history, tracks, thumbs_downed = station_db.load_station_history(station_id)
+    assert len(history) == 1
+    assert len(tracks) == 1
+    assert thumbs_downed[0].track.subsonic_id == "song1"
+
+
+def test_get_embedding_history_stored_embeddings(station_db):
+    """Test that stored embeddings are decoded with their ratings."""
+    from boldaric import feature_helper
+
+    user_id = station_db.create_user("testuser")
+    station_id = station_db.create_station(user_id, "Test Station")
+    track1 = create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+    track2 = create_track(station_db, "Artist 2", "Album 2", "Title 2", "song2")
+    station_db.add_track_to_or_update_history(station_id, track1, False, 5)
+    station_db.add_track_to_or_update_history(station_id, track2, True, -3)
+
+    history = station_db.get_embedding_history(station_id)
+    assert len(history) == 2
+
+    expected = {
+        5: feature_helper.get_track_embeddings(track1),
+        -3: feature_helper.get_track_embeddings(track2),
+    }
+    for i in range(len(history)):
+        rank = history.attractions[0, i]
+        assert (history.attractions[:, i] == rank).all()
+        np.testing.assert_array_equal(history.values[:, i], expected[rank])
+
+
+def test_add_track_links_genres(station_db):
+    """Test that genres are created once and linked with their scores."""
+    from boldaric.models.genre import Genre
+    from boldaric.models.track_genre import TrackGenre
+
+    track1 = create_track(
+        station_db,
+        "Artist 1",
+        "Album 1",
+        "Title 1",
+        "song1",
+        [{"label": "Rock", "score": 0.9}, {"label": "Blues", "score": 0.4}],
+    )
+    track2 = create_track(
+        station_db,
+        "Artist 2",
+        "Album 2",
+        "Title 2",
+        "song2",
+        [{"label": "Rock", "score": 0.7}, {"label": "Jazz", "score": 0.2}],
+    )
+
+    with station_db.Session() as session:
+        genres = {g.label: g.id for g in session.query(Genre).all()}
+        assert sorted(genres) == ["Blues", "Jazz", "Rock"]
+
+        links = {
+            (tg.track_id, tg.genre_id): tg.score
+            for tg in session.query(TrackGenre).all()
+        }
+    assert links == {
+        (track1.id, genres["Rock"]): 0.9,
+        (track1.id, genres["Blues"]): 0.4,
+        (track2.id, genres["Rock"]): 0.7,
+        (track2.id, genres["Jazz"]): 0.2,
+    }
+
+
+def test_add_tracks_bulk(station_db):
+    """Test that bulk added tracks match ones added one at a time."""
+    from boldaric.models.track_genre import TrackGenre
+
+    single = create_track(
+        station_db,
+        "Artist 1",
+        "Album 1",
+        "Title 1",
+        "song1",
+        [{"label": "Rock", "score": 0.9}],
+    )
+
+    tracks = [
+        track_fields(f"Artist {i}", f"Album {i}", f"Title {i}", f"song{i}")
+        for i in range(1, 6)
+    ]
+    tracks[2]["genre_list"] = [
+        {"label": "Rock", "score": 0.5},
+        {"label": "Jazz", "score": 0.3},
+    ]
+    # song1 already exists, and song2 is in there twice
+    tracks.append(track_fields("Other", "Other", "Other", "song2"))
+
+    assert station_db.add_tracks_bulk(tracks, batch_size=2) == 4
+
+    for i in range(2, 6):
+        track = station_db.get_track_by_subsonic_id(f"song{i}")
+        assert track.artist == f"Artist {i}"
+        assert track.embedding == single.embedding
+        assert track.embedding_version == single.embedding_version
+        np.testing.assert_array_equal(track.mfcc_mean_array, single.mfcc_mean_array)
+
+    track3 = station_db.get_track_by_subsonic_id("song3")
+    with station_db.Session() as session:
+        scores = sorted(
+            tg.score
+            for tg in session.query(TrackGenre).filter(TrackGenre.track_id == track3.id)
+        )
+    assert scores == [0.3, 0.5]
+
+
+def test_get_track_id_by_subsonic_id_cache(station_db):
+    """Test that track ids are cached, but the tracks themselves aren't."""
+    track = create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+
+    assert station_db.get_track_id_by_subsonic_id("song1") == track.id
+    assert station_db._track_id_cache["song1"] == track.id
+    assert station_db.get_track_id_by_subsonic_id("missing") is None
+    assert "missing" not in station_db._track_id_cache
+
+    # A change made through another StationDB (like the extractor's)
+    #  is seen straight away
+    other = StationDB(station_db.db_path)
+    track = other.get_track_by_subsonic_id("song1")
+    track.title = "New Title"
+    other.update_track(track)
+
+    assert station_db.get_track_by_subsonic_id("song1").title == "New Title"
+    assert station_db.get_tracks_by_subsonic_ids(["song1"])["song1"].title == (
+        "New Title"
+    )
+
+
+def test_add_track_id_to_or_update_history(station_db):
+    """Test recording history with just a track's id."""
+    user_id = station_db.create_user("testuser")
+    station_id = station_db.create_station(user_id, "Test Station")
+    track = create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+
+    track_id = station_db.get_track_id_by_subsonic_id("song1")
+    history_id = station_db.add_track_id_to_or_update_history(
+        station_id, track_id, False, 3
+    )
+    assert station_db.add_track_to_or_update_history(station_id, track, True) == (
+        history_id
+    )
+
+    history = station_db.get_track_history(station_id)
+    assert len(history) == 1
+    assert history[0].rating == 3
+    assert history[0].is_thumbs_downed
+
+
+def test_migrations_skipped_when_up_to_date(station_db):
+    """Test that reopening an up-to-date database doesn't run alembic."""
+    from unittest.mock import patch
+
+    with patch("boldaric.stationdb.command.upgrade") as upgrade:
+        StationDB(station_db.db_path)
+    upgrade.assert_not_called()
+
+
+def test_sqlite_pragmas(station_db):
+    """Test that connections are configured for WAL."""
+    from sqlalchemy import text
+
+    with station_db.engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # NORMAL
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        assert conn.execute(text("PRAGMA foreign_keys")).scalar() == 1
+        assert conn.execute(text("PRAGMA analysis_limit")).scalar() == 1000
+
+
+def test_history_statistics_gathered(station_db):
+    """Test that the planner gets statistics for the history once
+    there is some."""
+    from sqlalchemy import text
+
+    def history_stats(db):
+        with db.engine.connect() as conn:
+            return conn.execute(
+                text("SELECT idx FROM sqlite_stat1 WHERE tbl = 'track_history'")
+            ).all()
+
+    # A new database has nothing to gather
+    assert history_stats(station_db) == []
+
+    user_id = station_db.create_user("testuser")
+    station_id = station_db.create_station(user_id, "Test Station")
+    track = create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+    station_db.add_track_to_or_update_history(station_id, track, False)
+
+    # The next time the database is opened, they are gathered
+    indexes = {x[0] for x in history_stats(StationDB(station_db.db_path))}
+    assert "ix_track_history_station_updated" in indexes
+    assert "ix_track_history_station_track" in indexes
+
+
+def test_history_queries_use_indexes(station_db):
+    """Test that the history lookups walk an index instead of sorting."""
+    from sqlalchemy import text
+
+    queries = {
+        "SELECT id FROM track_history WHERE station_id = 1 "
+        "ORDER BY updated_at DESC": "ix_track_history_station_updated",
+        "SELECT id FROM track_history WHERE station_id = 1 "
+        "AND is_thumbs_downed = 1 ORDER BY updated_at": (
+            "ix_track_history_thumbs_downed"
+        ),
+    }
+    with station_db.engine.connect() as conn:
+        for query, index in queries.items():
+            plan = " ".join(
+                row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {query}"))
+            )
+            assert index in plan
+            assert "TEMP B-TREE" not in plan
+
+
+def test_read_engine_is_read_only(station_db):
+    """Test that the getters' connections can't write."""
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    user_id = station_db.create_user("testuser")
+    # Writes are visible to the read-only connections
+    assert station_db.get_user("testuser").id == user_id
+
+    with station_db.read_engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO users (username) VALUES ('nope')"))
+
+
+def test_get_tracks_by_subsonic_ids(station_db):
+    """Test looking up several tracks at once."""
+    create_track(station_db, "Artist 1", "Album 1", "Title 1", "song1")
+    create_track(station_db, "Artist 2", "Album 2", "Title 2", "song2")
+    create_track(station_db, "Artist 3", "Album 3", "Title 3", "song3")
+
+    tracks = station_db.get_tracks_by_subsonic_ids(["song1", "song3", "missing"])
+    assert set(tracks) == {"song1", "song3"}
+    assert tracks["song1"].title == "Title 1"
+    # The blobs are left out
+    assert "genre_embedding" not in tracks["song1"].__dict__
+    assert tracks["song3"].title == "Title 3"
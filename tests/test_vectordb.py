@@ -60,8 +60,10 @@ def make_track(features):
         artist="Test Artist",
         album="Test Album",
         title="Test Track",
-        genre_embedding=np.array(features["genre_embeddings"]).tobytes(),
-        mfcc_mean=np.array(features["mfcc"]["mean"]).tobytes(),
+        genre_embedding=np.array(
+            features["genre_embeddings"], dtype=np.float32
+        ).tobytes(),
+        mfcc_mean=np.array(features["mfcc"]["mean"], dtype=np.float32).tobytes(),
         groove_danceability=features["groove"]["danceability"],
         groove_tempo_stability=features["groove"]["tempo_stability"],
         mood_aggressiveness=features["mood"]["probabilities"]["aggressive"],
@@ -147,3 +149,37 @@ def test_query_similar(temp_db):
     assert (
         results[0]["similarity"] > results[1]["similarity"]
     ), "Results should be ordered by similarity"
+
+
+def test_query_similar_ignores_songs(temp_db):
+    t = make_track(SAMPLE_FEATURES)
+    temp_db.add_track(SAMPLE_SUBSONIC_ID, t)
+    temp_db.add_track("other-track", make_track(SAMPLE_FEATURES))
+
+    features = track_to_embeddings(t)
+
+    # ignored ids are filtered out by chroma
+    results = temp_db.query_similar(
+        features, n_results=3, ignore_ids={SAMPLE_SUBSONIC_ID}
+    )
+    assert [r["id"] for r in results] == ["other-track"]
+
+    # ignored songs match on (artist, title), whatever the id
+    results = temp_db.query_similar(
+        features, n_results=3, ignore_songs={("Test Artist", "Test Track")}
+    )
+    assert results == []
+
+
+def test_query_similar_requires_subsonic_id(temp_db):
+    t = make_track(SAMPLE_FEATURES)
+    temp_db.add_track(SAMPLE_SUBSONIC_ID, t)
+    temp_db.add_track("", make_track(SAMPLE_FEATURES))
+
+    features = track_to_embeddings(t)
+
+    results = temp_db.query_similar(features, n_results=3)
+    assert len(results) == 2
+
+    results = temp_db.query_similar(features, n_results=3, require_subsonic_id=True)
+    assert [r["id"] for r in results] == [SAMPLE_SUBSONIC_ID]